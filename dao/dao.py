@@ -1,24 +1,104 @@
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from sqlalchemy import create_engine
+import shapely
+from sqlalchemy import Integer, create_engine, text
+from sqlalchemy.engine import Engine, make_url
 from geoalchemy2 import WKTElement
 from dotenv import load_dotenv
 
+import io
 import os
-from typing import Literal
+from functools import cached_property
+from typing import Final, Iterator, Literal
+
+
+# Marker of NULL inside the csv streamed to COPY. Keeps empty strings as empty strings
+_COPY_NULL: Final = r'\N'
+
+
+def _quote(identifier: str) -> str:
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+def _integer_columns(data: pd.DataFrame, column_type: dict | None) -> pd.DataFrame:
+    """
+    Integer columns that pandas holds as float (because of NaN) would be written as `100.0`,
+        which COPY rejects for INTEGER / BIGINT. Cast them to nullable integers.
+    """
+    if column_type is None:
+        return data
+
+    casts = dict()
+    for col, col_type in column_type.items():
+        col_type = col_type if isinstance(col_type, type) else type(col_type)
+        if col in data.columns and issubclass(col_type, Integer) and pd.api.types.is_float_dtype(data[col]):
+            casts[col] = 'Int64'
+    return data.astype(casts) if casts else data
 
 
 class SimpleDatabaseAccess:
-    def __init__(self):
+    """
+    Owns a single long-lived, pooled engine. Every call borrows a connection from the pool
+        instead of creating and disposing an engine.
+    Use it as a context manager, or call `close` when done.
+
+        with SimpleDatabaseAccess() as dao:
+            dao.insert_dataframe(...)
+    """
+    def __init__(self,
+                 engine_str: str | None = None,
+                 pool_size: int = 5,
+                 max_overflow: int = 10,
+                 pool_pre_ping: bool = True):
+        """
+        :param engine_str: database url. PostgreSQL database in .env if None
+        :param pool_size: connections kept open in the pool
+        :param max_overflow: connections allowed on top of `pool_size` under load
+        :param pool_pre_ping: test a pooled connection before using it, and reconnect if it's stale
+        """
         load_dotenv()
-        username = os.getenv('USER')
-        password = os.getenv('PASSWORD')
-        host = os.getenv('HOST')
-        port = os.getenv('PORT')
-        name = os.getenv('NAME')
+        if engine_str is None:
+            username = os.getenv('USER')
+            password = os.getenv('PASSWORD')
+            host = os.getenv('HOST')
+            port = os.getenv('PORT')
+            name = os.getenv('NAME')
+            engine_str = f'postgresql://{username}:{password}@{host}:{port}/{name}'
 
-        # Create an engine
-        self.engine_str = f'postgresql://{username}:{password}@{host}:{port}/{name}'
+        self.engine_str = engine_str
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_pre_ping = pool_pre_ping
+
+    @cached_property
+    def engine(self) -> Engine:
+        # Create an engine on first use. It is reused by every call until `close`
+        pool_option = dict()
+        if make_url(self.engine_str).get_backend_name() != 'sqlite':
+            # SQLite (local stand-in) manages its own connection pool
+            pool_option = {'pool_size': self.pool_size, 'max_overflow': self.max_overflow}
+        return create_engine(self.engine_str, pool_pre_ping=self.pool_pre_ping, **pool_option)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        # Close every pooled connection. A new engine is created if the dao is used again
+        if 'engine' in self.__dict__:
+            self.__dict__.pop('engine').dispose()
+
+    @property
+    def _copy_available(self) -> bool:
+        # COPY ... FROM STDIN is streamed with psycopg2's `copy_expert`
+        return self.engine.dialect.name == 'postgresql' and self.engine.dialect.driver == 'psycopg2'
+
+    @staticmethod
+    def _qualified_name(schema: str | None, table: str):
+        return table if schema is None else f"{schema}.{table}"
 
     @staticmethod
     def _retrieve_table_name(value: str):
@@ -37,30 +117,56 @@ class SimpleDatabaseAccess:
                          target_table: str,
                          column_type: dict,
                          if_exists: Literal['append', 'replace'],
-                         verbose: bool = True):
+                         verbose: bool = True,
+                         chunksize: int = 50000):
+        """
+        Insert the dataframe in bulk. See `_bulk_insert`
+        :param data: process to insert
+        :param target_table: env key of the table name (`schema.table` or `table`)
+        :param column_type: { column : sqlalchemy type }. `process.constant` maps
+        :param if_exists: append to or replace the table
+        :param verbose:
+        :param chunksize: rows sent per COPY (or INSERT batch)
+        """
         schema, table = self._retrieve_table_name(target_table)
 
-        engine = create_engine(self.engine_str)
-        if column_type is None:
-            data.to_sql(
-                table,
-                engine,
-                schema=schema,
-                if_exists=if_exists,
-                index=False
-            )
-        else:
-            data.to_sql(
-                table,
-                engine,
-                schema=schema,
-                if_exists=if_exists,
-                index=False,
-                dtype=column_type,
-            )
+        self._bulk_insert(data, schema, table, column_type, if_exists, chunksize)
         if verbose:
             print(f"Inserted {len(data)} rows into {table}")
-        engine.dispose()
+
+    def _bulk_insert(self,
+                     data: pd.DataFrame,
+                     schema: str | None,
+                     table: str,
+                     column_type: dict | None,
+                     if_exists: Literal['append', 'replace'],
+                     chunksize: int):
+        """
+        Table is created (or replaced) with `column_type` by `to_sql`, with no rows.
+            Then rows are streamed through PostgreSQL `COPY ... FROM STDIN` in chunks of in-memory csv,
+            inside the same transaction.
+        Where COPY is not available (other database or driver), fall back to chunked `to_sql`.
+            It uses the driver's executemany, which SQLAlchemy 2 batches into multi-row INSERTs
+            (faster than `method='multi'`, which compiles a new statement per chunk)
+        """
+        with self.engine.begin() as conn:
+            if not self._copy_available:
+                data.to_sql(table, conn, schema=schema, if_exists=if_exists, index=False,
+                            dtype=column_type, chunksize=chunksize)
+                return
+
+            data.head(0).to_sql(table, conn, schema=schema, if_exists=if_exists, index=False, dtype=column_type)
+
+            data = _integer_columns(data, column_type)
+            columns = ', '.join(_quote(c) for c in data.columns)
+            name = _quote(table) if schema is None else f"{_quote(schema)}.{_quote(table)}"
+            query = f"COPY {name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{_COPY_NULL}')"
+            with conn.connection.cursor() as cursor:
+                for start in range(0, len(data), chunksize):
+                    buffer = io.StringIO()
+                    data.iloc[start:start + chunksize].to_csv(buffer, header=False, index=False, na_rep=_COPY_NULL)
+                    buffer.seek(0)
+                    cursor.copy_expert(query, buffer)
 
     def insert_geo_dataframe(self,
                              data: gpd.GeoDataFrame,
@@ -69,46 +175,122 @@ class SimpleDatabaseAccess:
                              if_exists: Literal['append', 'replace'],
                              geometry_column: str = 'geometry',
                              epsg: int = 4326,
-                             verbose: bool = True):
+                             verbose: bool = True,
+                             chunksize: int = 50000):
         # Data column type check
         assert geometry_column in column_type.keys()
         schema, table = self._retrieve_table_name(target_table)
 
-        # Before using `to_sql`, convert the geometry column in your DataFrame to WKT(Well-Known Text)
-        # using element (WKTElement). This is necessary because geoalchemy2 expects geometries in WKT format
-        # Should be single geometry column.
-        df = data.copy(deep=True)
-        df[geometry_column] = df[geometry_column].apply(
-            lambda x: WKTElement(x.wkt, srid=epsg)
+        # Should be single geometry column. The input is never copied -
+        # the converted geometry column replaces the original only in the frame that is sent.
+        geometry = np.asarray(data[geometry_column].values, dtype=object)
+        if self._copy_available:
+            # Whole column to hex EWKB (binary geometry with SRID) at once.
+            # PostGIS reads it straight into the `Geometry` column, without parsing WKT text
+            converted = shapely.to_wkb(shapely.set_srid(geometry, epsg), hex=True, include_srid=True)
+        else:
+            # geoalchemy2 expects geometries in WKT format (WKTElement) through `to_sql`
+            converted = [None if g is None else WKTElement(g.wkt, srid=epsg) for g in geometry]
+
+        df = pd.DataFrame(
+            {c: converted if c == geometry_column else data[c] for c in data.columns},
+            index=data.index,
+            copy=False
         )
 
-        engine = create_engine(self.engine_str)
-        df.to_sql(table, con=engine, schema=schema, if_exists=if_exists, index=False, dtype=column_type)
+        self._bulk_insert(df, schema, table, column_type, if_exists, chunksize)
         if verbose:
             print(f"Inserted {len(data)} rows into {table}")
-        engine.dispose()
 
-    def select_dataframe(self, target_table: str, verbose: bool = True):
+    def select_dataframe(self,
+                         target_table: str,
+                         verbose: bool = True,
+                         columns: list[str] | None = None,
+                         where: str | None = None,
+                         params: dict | None = None,
+                         chunksize: int | None = None) -> pd.DataFrame | Iterator[pd.DataFrame]:
+        """
+        :param target_table: env key of the table name (`schema.table` or `table`)
+        :param verbose:
+        :param columns: columns to select. Every column if None
+        :param where: row filter (SQL), with `:name` placeholders bound from `params`
+        :param params: values of the placeholders in `where`
+        :param chunksize: if given, return an iterator of dataframes of (at most) `chunksize` rows.
+            Rows are streamed with a server side cursor, so memory is bounded by a chunk
+        :return: dataframe, or iterator of dataframes
+        """
         schema, table = self._retrieve_table_name(target_table)
 
-        query = f"SELECT * FROM {schema}.{table}"
-        engine = create_engine(self.engine_str)
+        query = self._select_query(schema, table, columns, [where] if where else [])
 
         if verbose:
             print(f"Sending query {query}")
-        df = pd.read_sql(query, engine)
-        engine.dispose()
+        if chunksize is not None:
+            return self._stream(pd.read_sql, text(query), params=params, chunksize=chunksize)
+        df = pd.read_sql(text(query), self.engine, params=params)
         return df
 
-    def select_geo_dataframe(self, target_table: str, geometry_column: str = 'geometry', verbose: bool = True):
+    def select_geo_dataframe(self,
+                             target_table: str,
+                             geometry_column: str = 'geometry',
+                             verbose: bool = True,
+                             columns: list[str] | None = None,
+                             where: str | None = None,
+                             params: dict | None = None,
+                             bbox=None,
+                             epsg: int = 4326,
+                             chunksize: int | None = None) -> gpd.GeoDataFrame | Iterator[gpd.GeoDataFrame]:
+        """
+        :param target_table: env key of the table name (`schema.table` or `table`)
+        :param geometry_column:
+        :param verbose:
+        :param columns: columns to select. Every column if None. Geometry column is always selected
+        :param where: row filter (SQL), with `:name` placeholders bound from `params`
+        :param params: values of the placeholders in `where`
+        :param bbox: (west, south, east, north), or anything with a `bbox` of it (e.g. `grid.grid.Grid`).
+            Pushed down as `&& ST_MakeEnvelope(...)`, so PostGIS can use the spatial index
+        :param epsg: SRID of the bbox
+        :param chunksize: if given, return an iterator of geodataframes of (at most) `chunksize` rows.
+            Rows are streamed with a server side cursor, so memory is bounded by a chunk
+        :return: geodataframe, or iterator of geodataframes
+        """
         schema, table = self._retrieve_table_name(target_table)
 
-        query = f"SELECT * FROM {schema}.{table}"
-        engine = create_engine(self.engine_str)
+        if columns is not None and geometry_column not in columns:
+            columns = [*columns, geometry_column]
+
+        conditions = [where] if where else []
+        params = dict() if params is None else dict(params)
+        if bbox is not None:
+            west, south, east, north = getattr(bbox, 'bbox', bbox)
+            conditions.append(
+                f"{_quote(geometry_column)} && "
+                f"ST_MakeEnvelope(:bbox_west, :bbox_south, :bbox_east, :bbox_north, :bbox_srid)"
+            )
+            params.update({
+                'bbox_west': float(west), 'bbox_south': float(south),
+                'bbox_east': float(east), 'bbox_north': float(north),
+                'bbox_srid': epsg,
+            })
+
+        query = self._select_query(schema, table, columns, conditions)
 
         if verbose:
             print(f"Sending geo query {query}")
-        gdf = gpd.read_postgis(query, engine, geom_col=geometry_column)
-        engine.dispose()
+        if chunksize is not None:
+            return self._stream(gpd.read_postgis, text(query), geom_col=geometry_column,
+                                params=params, chunksize=chunksize)
+        gdf = gpd.read_postgis(text(query), self.engine, geom_col=geometry_column, params=params)
         return gdf
 
+    def _select_query(self, schema: str | None, table: str, columns: list[str] | None, conditions: [str]) -> str:
+        selected = '*' if columns is None else ', '.join(_quote(c) for c in columns)
+        query = f"SELECT {selected} FROM {self._qualified_name(schema, table)}"
+        if conditions:
+            query += " WHERE " + " AND ".join(f"({c})" for c in conditions)
+        return query
+
+    def _stream(self, reader, query, **kwargs):
+        # Keep a connection with a server side cursor open while the chunks are consumed
+        with self.engine.connect().execution_options(stream_results=True) as conn:
+            yield from reader(query, conn, **kwargs)
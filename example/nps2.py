@@ -5,11 +5,11 @@
 
 import pandas as pd
 import geopandas as gpd
-import numpy as np
 from dotenv import load_dotenv
 from shapely import Point
 
 from process.data_entity_nps import NPS, CollectEntityCoordinate
+from process.geocode import VWorldGeocoder
 from process.constant import nps_clean_column
 from dao.dao import SimpleDatabaseAccess
 
@@ -22,20 +22,9 @@ df = NPS.prep_merge(dao.select_dataframe('FACTOR_PENSION'))
 collect = CollectEntityCoordinate()
 cleaned = collect.clean(df)
 
-# Get coordinate
-coords = list()
-for addr in cleaned['address']:
-    try:
-        coord = CollectEntityCoordinate.address_to_coord(
-            addr,
-            True
-        )
-        coords.append(coord)
-    except FileNotFoundError as e:
-        coords.append({'x': np.nan, 'y': np.nan})
-
-coords_df = pd.DataFrame([[c['x'], c['y']] for c in coords],
-                         columns=['x', 'y'])
+# Get coordinate. Addresses resolved on earlier runs come from the cache
+with VWorldGeocoder(qps=10, max_workers=8, verbose=True) as geocoder:
+    coords_df = geocoder.geocode_many(cleaned['address'])
 
 # Merge NPS data with Coordinate
 nps_with_coord = pd.concat([cleaned, coords_df], axis=1)
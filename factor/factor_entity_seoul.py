@@ -3,33 +3,33 @@ from grid.grid import Coordinate, Grid, grid_matching_point
 from grid.grid_major_coordinate import SEOUL_CITYHALL_LAT, SEOUL_CITYHALL_LON
 from grid.grid_major_coordinate import SeoulBoundary
 
-# ---- Data Layout ---- #
-# Get it from Database
-dao = SimpleDatabaseAccess()
-df = dao.select_geo_dataframe('CLEAN_PENSION')
-
 # ---- Grid Mapping ---- #
 seoul = Coordinate(SEOUL_CITYHALL_LON, SEOUL_CITYHALL_LAT)
 g = Grid(seoul, SeoulBoundary, 100, "SeoulNPS")
 
+# ---- Data Layout ---- #
+# Get it from Database. Only the rows inside the grid
+dao = SimpleDatabaseAccess()
+df = dao.select_geo_dataframe('CLEAN_PENSION', bbox=g)
+
 # ---- Grid Assigning ---- #
 matched = grid_matching_point(g, df, ('x', 'y'), True)
-matched_np = matched.to_numpy()
+startings = [g.grid_element_map[i] for i in matched['grid_index'].unique()]
 
-g.push_data_to_grids({v[0]: v[4] for v in matched_np}, 'amount', 'number', True)
-g.push_data_to_grids({v[0]: v[1] for v in matched_np}, 'business', 'string', True)
-g.push_data_to_grids({v[0]: v[3] for v in matched_np}, 'workers', 'number', True)
+g.push_column_to_grids(matched, 'amount', 'amount', 'sum')
+g.push_column_to_grids(matched, 'corpNm', 'business', 'join')
+g.push_column_to_grids(matched, 'ppl', 'workers', 'sum')
 
 # ---- Grid Spillover ---- #
 g.trickle_down(
-    [g.grid_element_map[v[0]] for v in matched_np],
+    startings,
     1000 // g.single_size,
     'amount',
     '*0.8'
 )
 
 g.trickle_down(
-    [g.grid_element_map[v[0]] for v in matched_np],
+    startings,
     1000 // g.single_size,
     'workers',
     '*0.6'
@@ -16,18 +16,29 @@ g = Grid(gangnam, GangnamStnBoundary, 100, "GangnamSubway")
 
 # ---- Grid Assigning ---- #
 matched = grid_matching_point(g, locate_fpt, ('lon', 'lat'), True)
-matched_np = matched.to_numpy()
+startings = [g.grid_element_map[i] for i in matched['grid_index'].unique()]
 
-g.push_data_to_grids({v[0]: v[13] for v in matched_np}, 'arrive0809', 'number', True)  # 08-09 하차인원
+g.push_column_to_grids(matched, '08시-09시 하차인원', 'arrive0809', 'sum')  # 08-09 하차인원
 
 # ---- Grid Spillover ---- #
 g.trickle_down(
-    [g.grid_element_map[v[0]] for v in matched_np],
+    startings,
     1000 // g.single_size,
     'arrive0809',
     '*0.8'
 )
 
+# ---- Hour of day ---- #
+# Every hour, embark and disembark in one (grids x 24 x 2) layer. Pushed and trickled down at once
+g.push_array_to_grids(matched['grid_index'], FloatPopulationSubwayTime.hourly_array(matched), 'hourly', 'sum')
+g.trickle_down(
+    startings,
+    1000 // g.single_size,
+    'hourly',
+    '*0.8'
+)
+
 # ---- Data Display ---- #
 dfn = g.grid_dataframe('arrive0809')
+dfn_hourly = g.grid_dataframe('hourly', (8, 1))  # 08-09 하차인원, same as `arrive0809`
 dfk = g.kepler_dataframe(['arrive0809'])
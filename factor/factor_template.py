@@ -18,7 +18,7 @@ matched_np_point = matched_point.to_numpy()
 matched_line = grid_matching_line(g, ..., ..., True)
 matched_np_line = matched_line.to_numpy()
 
-g.push_data_to_grids({v[0]: v[...] for v in matched_np_point}, '...', '...', True)  # Your value
+g.push_column_to_grids(matched_point, '...', '...', 'sum')  # Your value. sum, mean, count, max, min or join
 
 # ---- Grid Spillover ---- #
 
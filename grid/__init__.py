@@ -1,2 +1,3 @@
 from . import grid
-from . import grid_major_coordinate
\ No newline at end of file
+from . import grid_major_coordinate
+from . import decay
\ No newline at end of file
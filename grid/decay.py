@@ -0,0 +1,119 @@
+import numpy as np
+
+from typing import Callable
+
+
+class DecayKernel:
+    """
+    How the impact of a starting grid decays with the distance (number of steps) from it.
+        The impact `d` steps away is `value * scale[d] + offset[d]`
+    Kernels are parsed once. `weights` produces the whole per-distance vectors ahead of time,
+        so trickling down only looks them up by distance.
+    """
+    def __init__(self):
+        self._cache = dict()
+
+    def scale(self, distance: np.ndarray) -> np.ndarray:
+        return np.ones_like(distance)
+
+    def offset(self, distance: np.ndarray) -> np.ndarray:
+        return np.zeros_like(distance)
+
+    def weights(self, reach: int) -> (np.ndarray, np.ndarray):
+        """
+        :param reach: furthest distance
+        :return: (scale, offset) arrays of length reach + 1
+        """
+        if reach not in self._cache:
+            distance = np.arange(reach + 1, dtype=np.float64)
+            self._cache[reach] = (
+                np.asarray(self.scale(distance), dtype=np.float64),
+                np.asarray(self.offset(distance), dtype=np.float64),
+            )
+        return self._cache[reach]
+
+    def __repr__(self):
+        params = ', '.join(f"{k}={v}" for k, v in vars(self).items() if not k.startswith('_'))
+        return f"{self.__class__.__name__}({params})"
+
+
+class Multiplicative(DecayKernel):
+    # "*<rate>": value * rate per step
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def scale(self, distance: np.ndarray) -> np.ndarray:
+        return self.rate ** distance
+
+
+class Subtractive(DecayKernel):
+    # "-<decay>": value - decay per step
+    def __init__(self, decay: float):
+        super().__init__()
+        self.decay = decay
+
+    def offset(self, distance: np.ndarray) -> np.ndarray:
+        return -self.decay * distance
+
+
+class Additive(DecayKernel):
+    # "<decay>": value + decay per step
+    def __init__(self, decay: float):
+        super().__init__()
+        self.decay = decay
+
+    def offset(self, distance: np.ndarray) -> np.ndarray:
+        return self.decay * distance
+
+
+class Gaussian(DecayKernel):
+    # value * exp(-d^2 / 2 sigma^2). sigma is counted in steps
+    def __init__(self, sigma: float):
+        super().__init__()
+        self.sigma = sigma
+
+    def scale(self, distance: np.ndarray) -> np.ndarray:
+        return np.exp(-distance ** 2 / (2 * self.sigma ** 2))
+
+
+class InverseDistance(DecayKernel):
+    # value / (1 + d) ^ power
+    def __init__(self, power: float = 1.0):
+        super().__init__()
+        self.power = power
+
+    def scale(self, distance: np.ndarray) -> np.ndarray:
+        return 1 / (1 + distance) ** self.power
+
+
+class Custom(DecayKernel):
+    # value * func(d). func is called once per distance (d = 0, 1, 2 ...)
+    def __init__(self, func: Callable[[int], float]):
+        super().__init__()
+        self.func = func
+
+    def scale(self, distance: np.ndarray) -> np.ndarray:
+        return np.array([self.func(int(d)) for d in distance], dtype=np.float64)
+
+
+def parse_decay(decay_factors: 'str | DecayKernel | Callable[[int], float]') -> DecayKernel:
+    """
+    :param decay_factors: should be string in order to make different calculation
+        1. *<number>: value * decay number(float)
+        2. -<number>: value - decay number(float)
+        3. (else): value + decay number(float)
+        DecayKernel is used as it is, and any other callable becomes a `Custom` kernel
+    :return: DecayKernel
+    """
+    if isinstance(decay_factors, DecayKernel):
+        return decay_factors
+    if callable(decay_factors):
+        return Custom(decay_factors)
+
+    if "*" in decay_factors:
+        return Multiplicative(float(decay_factors.replace("*", '')))
+    elif "-" in decay_factors:
+        return Subtractive(float(decay_factors.replace("-", '')))
+    else:
+        return Additive(float(decay_factors))
@@ -1,19 +1,55 @@
 import pandas as pd
 import numpy as np
 from pyproj import Geod
-from shapely import LineString, box
+import shapely
+from shapely import LineString, STRtree, box
 
-from collections import deque
-from copy import copy
+import json
+import os
+from collections.abc import Mapping, MutableMapping
+from functools import cached_property
+from typing import Callable, Final, Literal
 
+from grid.decay import DecayKernel, parse_decay
 from grid.grid_major_coordinate import BaseBoundary
 
 
+# Define the WGS84 engine ellipsoid coordinate system. Shared by every Coordinate and Grid
+GEOD: Final = Geod(ellps='WGS84')
+
+# Generated process (kepler.gl csv etc.) are saved here by default
+GENERATE_PATH: Final = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'generate')
+
+HEADING: Final = {
+    "north": 0,
+    "east": 90,
+    "south": 180,
+    "west": 270,
+}
+
+
+def move_many(lons, lats, azimuths, distances) -> (np.ndarray, np.ndarray):
+    """
+    Vectorized `Coordinate.move`. Move every (lon, lat) `distance` meters toward `azimuth`
+        in a single call to the shared geodesic engine. Scalars are broadcast against arrays.
+    :param lons: longitudes
+    :param lats: latitudes
+    :param azimuths: degrees clockwise from north. See `HEADING`
+    :param distances: meters. A negative distance moves to the opposite direction
+    :return: (new longitudes, new latitudes)
+    """
+    lons, lats, azimuths, distances = [
+        np.array(v, dtype=np.float64)
+        for v in np.broadcast_arrays(lons, lats, azimuths, distances)
+    ]
+    new_lon, new_lat, _ = GEOD.fwd(lons, lats, azimuths, distances)
+    return new_lon, new_lat
+
+
 class Coordinate:
-    def __init__(self, longitude: float, latitude: float):
-        # Define the WGS84 engine ellipsoid coordinate system
-        self.geod = Geod(ellps='WGS84')
+    geod = GEOD
 
+    def __init__(self, longitude: float, latitude: float):
         self.lon = longitude
         self.lat = latitude
 
@@ -26,14 +62,7 @@ class Coordinate:
         Move 'distance_meter' to any direction in north, east, south and west and
             returns the new (longitude, latitude)
         """
-        head = {
-            "north": 0,
-            "east": 90,
-            "south": 180,
-            "west": 270,
-        }
-
-        new_lon, new_lat, _ = self.geod.fwd(self.lon, self.lat, head[direction], distance_meter)
+        new_lon, new_lat, _ = self.geod.fwd(self.lon, self.lat, HEADING[direction], distance_meter)
 
         if new is False:
             self.lon = new_lon
@@ -48,24 +77,120 @@ class Coordinate:
         return new_copy
 
 
+class CellData(MutableMapping):
+    """
+    Dictionary-like view of a single cell's values inside the Grid's layer store.
+        Reading `cell['amount']` reads `grid.layers['amount'][index]`, writing it writes back.
+    A key is considered to be missing for the cell when the layer holds NaN (number layer)
+        or None (string / object layer) at the cell's index.
+    """
+    def __init__(self, grid: 'Grid', index: int):
+        self._grid = grid
+        self._index = index
+
+    def __getitem__(self, key: str):
+        if key not in self._grid.layers:
+            raise KeyError(key)
+
+        value = self._grid.layers[key][self._index]
+        if _is_missing(value):
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: any):
+        layer = self._grid.layer(key, dtype=_layer_dtype(value))
+        if layer.dtype != object and _layer_dtype(value) == object:
+            # Number layer receiving a non-number value. Promote the whole layer
+            layer = self._grid.layers[key] = layer.astype(object)
+        layer[self._index] = value
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        layer = self._grid.layers[key]
+        layer[self._index] = None if layer.dtype == object else np.nan
+
+    def __iter__(self):
+        for key, layer in self._grid.layers.items():
+            if not _is_missing(layer[self._index]):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def _is_missing(value: any) -> bool:
+    if value is None:
+        return True
+    return isinstance(value, float) and np.isnan(value)
+
+
+def _layer_dtype(value: any):
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return np.float64
+    return object
+
+
 class GridElement:
-    def __init__(self, center: Coordinate, grid_size_meter: float):
-        self.center = center
-        self.single_size = grid_size_meter
+    """
+    Thin, lazily created view over one cell of a Grid.
+        The cell's center, neighbors and process values all live in the Grid's arrays.
+        Nothing is stored on the view itself besides the owning grid and the cell index.
+    """
+    def __init__(self, grid: 'Grid', index: int):
+        self.grid = grid
+        self.index = index
+        self.data_single = CellData(grid, index)
 
-        self.index = -1  # -1 means that the Grid is yet to be assigned an index
-        self.data_single = dict()
+    @property
+    def center(self) -> Coordinate:
+        return Coordinate(float(self.grid.center_lon[self.index]), float(self.grid.center_lat[self.index]))
 
-        # Nearby Grid
-        self.north: GridElement | None = None
-        self.south: GridElement | None = None
-        self.west: GridElement | None = None
-        self.east: GridElement | None = None
+    @property
+    def single_size(self) -> float:
+        return self.grid.single_size
 
-        self.northeast: GridElement | None = None
-        self.northwest: GridElement | None = None
-        self.southeast: GridElement | None = None
-        self.southwest: GridElement | None = None
+    # Nearby Grid
+    @property
+    def north(self) -> 'GridElement | None':
+        return self.grid.element_at(self.index, -1, 0)
+
+    @property
+    def south(self) -> 'GridElement | None':
+        return self.grid.element_at(self.index, 1, 0)
+
+    @property
+    def west(self) -> 'GridElement | None':
+        return self.grid.element_at(self.index, 0, -1)
+
+    @property
+    def east(self) -> 'GridElement | None':
+        return self.grid.element_at(self.index, 0, 1)
+
+    @property
+    def northeast(self) -> 'GridElement | None':
+        return self.grid.element_at(self.index, -1, 1)
+
+    @property
+    def northwest(self) -> 'GridElement | None':
+        return self.grid.element_at(self.index, -1, -1)
+
+    @property
+    def southeast(self) -> 'GridElement | None':
+        return self.grid.element_at(self.index, 1, 1)
+
+    @property
+    def southwest(self) -> 'GridElement | None':
+        return self.grid.element_at(self.index, 1, -1)
+
+    def __eq__(self, other):
+        return isinstance(other, GridElement) and other.grid is self.grid and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.grid), self.index))
 
     def __repr__(self):
         def dply(val: GridElement | None, standard: int):
@@ -115,53 +240,45 @@ class GridElement:
     def set_data_value(self, data_key: str, data_value: any):
         self.data_single[data_key] = data_value
 
+    @property
+    def bounds(self) -> (float, float, float, float):
+        """
+        (west, south, east, north) of the grid. Read from the grid's precomputed bounds array
+        """
+        west, south, east, north = self.grid.bounds[self.index]
+        return float(west), float(south), float(east), float(north)
+
     @property
     def top_left(self) -> Coordinate:
-        return (self.center.
-                move(self.single_size / 2, 'north').
-                move(self.single_size / 2, 'west'))
+        west, _, _, north = self.bounds
+        return Coordinate(west, north)
 
     @property
     def top_right(self) -> Coordinate:
-        return (self.center.
-                move(self.single_size / 2, 'north').
-                move(self.single_size / 2, 'east'))
+        _, _, east, north = self.bounds
+        return Coordinate(east, north)
 
     @property
     def bottom_left(self) -> Coordinate:
-        return (self.center.
-                move(self.single_size / 2, 'south').
-                move(self.single_size / 2, 'west'))
+        west, south, _, _ = self.bounds
+        return Coordinate(west, south)
 
     @property
-    def bottom_right(self):
-        return (self.center.
-                move(self.single_size / 2, 'south').
-                move(self.single_size / 2, 'east'))
+    def bottom_right(self) -> Coordinate:
+        _, south, east, _ = self.bounds
+        return Coordinate(east, south)
 
     def has(self, lon: float = None, lat: float = None, coord: Coordinate = None) -> bool:
         if lat is None and lon is None and coord is None:
             raise RuntimeError("must enter (lat, lon) or coordinate")
 
-        grid_top_left = self.top_left
-        grid_bottom_right = self.bottom_right
+        if lat is None or lon is None:
+            if coord is None:
+                raise RuntimeError("check your input")
+            lon, lat = coord.coordinate
 
-        if lat is not None and lon is not None:
-            if (grid_bottom_right.lat < lat < grid_top_left.lat
-                    and grid_top_left.lon < lon < grid_bottom_right.lon):
-                return True
-            else:
-                return False
-
-        elif coord is not None:
-            if (grid_bottom_right.lat < coord.lat < grid_top_left.lat
-                    and grid_top_left.lon < coord.lon < grid_bottom_right.lon):
-                return True
-            else:
-                return False
-
-        else:
-            raise RuntimeError("check your input")
+        west, south, east, north = self.bounds
+        return south < lat < north and west < lon < east
 
     def pass_through(self, linestring: LineString) -> bool:
         """
@@ -170,15 +287,33 @@ class GridElement:
         :return:
         """
         # Define a shapely box (polygon) representing the grid
-        grid_box = box(
-            self.top_left.lon, self.top_left.lat,
-            self.bottom_right.lon, self.bottom_right.lat
-        )
+        grid_box = box(*self.bounds)
 
         # Check if the LineString intersects or is contained in the grid
         return grid_box.intersects(linestring) or grid_box.contains(linestring)
 
 
+class GridElementMap(Mapping):
+    """
+    Read-only { grid index : GridElement } mapping that creates GridElement views on access.
+        Keeps `grid.grid_element_map[idx]`, `.items()` and `.values()` working
+        without holding one Python object per cell.
+    """
+    def __init__(self, grid: 'Grid'):
+        self._grid = grid
+
+    def __getitem__(self, index: int) -> GridElement:
+        if not 0 <= index < self._grid.size:
+            raise KeyError(index)
+        return GridElement(self._grid, int(index))
+
+    def __iter__(self):
+        return iter(range(self._grid.size))
+
+    def __len__(self):
+        return self._grid.size
+
+
 class Grid:
     EARTH_RADIUS = 6371.0
 
@@ -188,78 +323,178 @@ class Grid:
         self.single_size = grid_size_meter
 
         # n (vertical) * m (horizontal) grid. Control n with latitude, and m with longitude
-        self.n = (self.boundary.UP.value + self.boundary.DOWN.value) * 1000 // self.single_size + 1
-        self.m = (self.boundary.LEFT.value + self.boundary.RIGHT.value) * 1000 // self.single_size + 1
+        self.n = int((self.boundary.UP.value + self.boundary.DOWN.value) * 1000 // self.single_size + 1)
+        self.m = int((self.boundary.LEFT.value + self.boundary.RIGHT.value) * 1000 // self.single_size + 1)
+        self.size = self.n * self.m
 
         # Generate Grid Map, and its mapper.
+        self.name = name
         self.grid_name = f"{name}_{self.n}by{self.m}grid_{self.single_size}size"
         self.start = start
-        self.grid_element_map = dict()
+
+        # Cell index is `i * m + j` for row i (north -> south) and column j (west -> east)
+        self.center_lon = np.empty(self.size, dtype=np.float64)
+        self.center_lat = np.empty(self.size, dtype=np.float64)
+        self.lon_edges = np.empty((self.n, self.m + 1), dtype=np.float64)
+        self.lat_edges = np.empty(self.n + 1, dtype=np.float64)
+        self.bounds = np.empty((self.size, 4), dtype=np.float64)
+
+        # Columnar layer store. { value_key : array of length n * m }
+        self.layers: dict[str, np.ndarray] = dict()
+
+        self.grid_element_map = GridElementMap(self)
         self.nm_grid_element()
 
-    def _create_nm_coordinate(self) -> [Coordinate]:
+    def _grid_start(self) -> Coordinate:
+        # Calculate center of the top left grid
+        return (self.start.
+                move(self.boundary.UP.value * 1000, 'north').
+                move(self.boundary.LEFT.value * 1000, 'west'))
+
+    def _project_rows(self, row_steps: np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        Western-most point of the rows `row_steps` grids south of the top left center
+        :return: (longitude, latitude) of each row_steps
+        """
+        grid_start = self._grid_start()
+        return move_many(grid_start.lon, grid_start.lat, HEADING['south'], np.asarray(row_steps) * self.single_size)
+
+    def _project_cols(self, row_lon: np.ndarray, row_lat: np.ndarray, col_steps: np.ndarray) -> np.ndarray:
+        """
+        Longitudes `col_steps` grids east of every row start.
+            Every row steps east along its own latitude, one grid at a time,
+            so a cell is `single_size` wide on every row (meridians converge toward the north)
+        :return: (len(row_lon), len(col_steps)) longitudes
+        """
+        east_lon, _ = move_many(row_lon, row_lat, HEADING['east'], self.single_size)
+        return row_lon[:, None] + np.outer(east_lon - row_lon, col_steps)
+
+    def _create_nm_coordinate(self) -> (np.ndarray, np.ndarray):
         """
         Create center coordinates for each to-be-generated grid element.
-        :return: list of class Coordinate
+            Rows share a single latitude, columns are laid out per row.
+        :return: ((n, m) longitude of each center, latitude of each row)
         """
-        # Calculate top right of the grid
-        grid_start = (self.start.
-                      move(self.boundary.UP.value * 1000, 'north').
-                      move(self.boundary.LEFT.value * 1000, 'west').
-                      move(self.single_size, 'west'))
+        row_lon, row_lat = self._project_rows(np.arange(self.n))
+        return self._project_cols(row_lon, row_lat, np.arange(self.m)), row_lat
 
-        result = []
-        for i in range(self.n):
-            grid_i = copy(grid_start).move(i * self.single_size, 'south', False)
+    def _create_nm_edges(self) -> (np.ndarray, np.ndarray):
+        """
+        Create the cell edges, half a grid away from the centers.
+            Edge k of the rows is the northern edge of row k (the last one is the southern edge of the grid)
+            Edge k of a row is the western edge of column k (the last one is the eastern edge of the row)
+        :return: ((n, m + 1) longitude edges west -> east per row, n + 1 latitude edges north -> south)
+        """
+        row_lon, row_lat = self._project_rows(np.arange(self.n))
+        _, lat_edges = self._project_rows(np.arange(self.n + 1) - 0.5)
+        return self._project_cols(row_lon, row_lat, np.arange(self.m + 1) - 0.5), lat_edges
 
-            for j in range(self.m):
-                grid_i = grid_i.move(self.single_size, 'east', False)
-                result.append(copy(grid_i))
+    def nm_grid_element(self):
+        """
+        Fill the center coordinate and the cell edge arrays of the grid.
+            Neighbors are not stored. They are resolved with (i, j) arithmetic in `element_at`
+        """
+        center_lon, row_lat = self._create_nm_coordinate()
+        self.center_lon[:] = center_lon.ravel()
+        self.center_lat[:] = np.repeat(row_lat, self.m)
+
+        lon_edges, lat_edges = self._create_nm_edges()
+        self.lon_edges = np.asarray(lon_edges, dtype=np.float64)
+        self.lat_edges = np.asarray(lat_edges, dtype=np.float64)
+
+        # (n * m, 4) cell bounds. west, south, east, north - same order as shapely `box`
+        i = np.repeat(np.arange(self.n), self.m)
+        self.bounds = np.column_stack([
+            self.lon_edges[:, :-1].ravel(),
+            self.lat_edges[i + 1],
+            self.lon_edges[:, 1:].ravel(),
+            self.lat_edges[i],
+        ])
+
+    def locate(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        """
+        Find the grid index of every (lon, lat) point in a single pass.
+            Row comes from the latitude edges and column from the longitude edges of that row (binary search)
+            Points outside the grid, on a cell edge or with NaN coordinates get -1,
+            just like `GridElement.has` never matches them.
+        :param lon: longitude array
+        :param lat: latitude array
+        :return: int64 array of grid index (or -1)
+        """
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+
+        # Latitude edges go north -> south. Flip the sign to search on an ascending array
+        i = np.searchsorted(-self.lat_edges, -lat, side='right') - 1
+        i_safe = np.clip(i, 0, self.n - 1)
+
+        # Rows are laid one after another on a single ascending array, each shifted by `span`,
+        # so every point is searched within its own row
+        west = self.lon_edges[:, 0].min()
+        span = 2 * (self.lon_edges[:, -1].max() - west) + 1
+        shift = np.arange(self.n)[:, None] * span
+        k = np.searchsorted((self.lon_edges - west + shift).ravel(), lon - west + i_safe * span, side='right')
+        j = k - i_safe * (self.m + 1) - 1
+        # Shifting may round a point right below an edge onto it
+        j_safe = np.clip(j, 0, self.m)
+        j -= lon < self.lon_edges[i_safe, j_safe]
+
+        inside = (0 <= i) & (i < self.n) & (0 <= j) & (j < self.m)
+        j_safe = np.where(inside, j, 0)
+        inside &= (lat != self.lat_edges[i_safe]) & (lon != self.lon_edges[i_safe, j_safe])
+
+        return np.where(inside, i * self.m + j, -1).astype(np.int64)
+
+    def element_at(self, index: int, di: int = 0, dj: int = 0) -> GridElement | None:
+        """
+        GridElement that is `di` rows south and `dj` columns east of the `index`.
+            None if it falls outside the grid
+        """
+        i, j = divmod(index, self.m)
+        i, j = i + di, j + dj
+        if 0 <= i < self.n and 0 <= j < self.m:
+            return GridElement(self, i * self.m + j)
+        return None
 
+    def neighbors(self, index: int) -> [int]:
+        """
+        Index of (up to 8) neighboring grids - north, south, east, west and the diagonals
+        """
+        i, j = divmod(index, self.m)
+        result = []
+        for di, dj in ((-1, 0), (1, 0), (0, 1), (0, -1), (-1, 1), (-1, -1), (1, 1), (1, -1)):
+            if 0 <= i + di < self.n and 0 <= j + dj < self.m:
+                result.append((i + di) * self.m + (j + dj))
         return result
 
-    def nm_grid_element(self) -> [GridElement]:
-        grid_center_points = self._create_nm_coordinate()
-        grid_elements = [GridElement(p, grid_size_meter=self.single_size)
-                         for p in grid_center_points]
-
-        # Assign each grid an index. Record it in self.grid_element_map
-        for idx, e in enumerate(grid_elements):
-            e.index = idx
-            self.grid_element_map[idx] = e
-
-        # Assign relationship with each grid
-        for i in range(self.n):
-            no_up: bool = i == 0
-            no_down: bool = i == (self.n - 1)
-
-            for j in range(self.m):
-                grid_to_assign = i * self.m + j
-
-                no_left: bool = j == 0
-                no_right: bool = j == (self.m - 1)
-
-                # Right angle bearing assign
-                if not no_up:
-                    grid_elements[grid_to_assign].north = grid_elements[(i - 1) * self.m + j]
-                if not no_down:
-                    grid_elements[grid_to_assign].south = grid_elements[(i + 1) * self.m + j]
-                if not no_left:
-                    grid_elements[grid_to_assign].west = grid_elements[i * self.m + (j - 1)]
-                if not no_right:
-                    grid_elements[grid_to_assign].east = grid_elements[i * self.m + (j + 1)]
-
-                # Diagonal bearing assign
-                if not no_up and not no_left:
-                    grid_elements[grid_to_assign].northwest = grid_elements[(i - 1) * self.m + j - 1]
-                if not no_up and not no_right:
-                    grid_elements[grid_to_assign].northeast = grid_elements[(i - 1) * self.m + j + 1]
-                if not no_down and not no_left:
-                    grid_elements[grid_to_assign].southwest = grid_elements[(i + 1) * self.m + j - 1]
-                if not no_down and not no_right:
-                    grid_elements[grid_to_assign].southeast = grid_elements[(i + 1) * self.m + j + 1]
-
-        return grid_elements
+    @property
+    def bbox(self) -> (float, float, float, float):
+        """
+        (west, south, east, north) of the whole grid
+        """
+        return (float(self.lon_edges[:, 0].min()), float(self.lat_edges[-1]),
+                float(self.lon_edges[:, -1].max()), float(self.lat_edges[0]))
+
+    @cached_property
+    def cell_tree(self) -> STRtree:
+        """
+        STRtree of every cell polygon, built once on first use.
+            Tree index of a cell is the cell's grid index
+        """
+        cells = shapely.box(self.bounds[:, 0], self.bounds[:, 1], self.bounds[:, 2], self.bounds[:, 3])
+        return STRtree(cells)
+
+    def layer(self, value_key: str, dtype=np.float64) -> np.ndarray:
+        """
+        Column of `value_key` over every grid. Created if it does not exist yet.
+            Number layers are float64 and filled with NaN, other layers are object and filled with None
+        """
+        if value_key not in self.layers:
+            if dtype == object:
+                self.layers[value_key] = np.full(self.size, None, dtype=object)
+            else:
+                self.layers[value_key] = np.full(self.size, np.nan, dtype=dtype)
+        return self.layers[value_key]
 
     def push_data_to_grids(self, grid_data_map: dict, value_key: str, value_type: str, verbose: bool = False):
         """
@@ -269,235 +504,436 @@ class Grid:
         :param value_type: Differs by its type. string or number(float or int)
         :param verbose:
         """
-        for k, v in self.grid_element_map.items():
-            if value_type == "string":
-                if k in grid_data_map.keys():
-                    if verbose:
-                        print(f"[Grid {k}] Update")
-                        print(f"Already process inserted beforehand. Adding {grid_data_map[k]} to {self.grid_element_map[k]}")
-                    v.upsert_data_value(value_key, f" {grid_data_map[k]}")
-                else:
-                    v.upsert_data_value(value_key, "")
-            elif value_type == "number":
-                if k in grid_data_map.keys():
-                    if verbose:
-                        print(f"[Grid {k}] Update")
-                        print(f"Already process inserted beforehand. Adding {grid_data_map[k]} to {self.grid_element_map[k]}")
-                    v.upsert_data_value(value_key, grid_data_map[k])
-                else:
-                    v.upsert_data_value(value_key, 0)
+        if verbose:
+            for k, v in grid_data_map.items():
+                print(f"[Grid {k}] Update")
+                print(f"Already process inserted beforehand. Adding {v} to {self.grid_element_map[k]}")
+
+        if value_type == "string":
+            layer = self.layer(value_key, dtype=object)
+            layer[np.equal(layer, None)] = ""
+            for k, v in grid_data_map.items():
+                layer[k] += f" {v}"
+        elif value_type == "number":
+            layer = self.layer(value_key)
+            layer[np.isnan(layer)] = 0
+            index = np.fromiter(grid_data_map.keys(), dtype=np.int64, count=len(grid_data_map))
+            value = np.fromiter(grid_data_map.values(), dtype=np.float64, count=len(grid_data_map))
+            layer[index] += value
+        else:
+            raise RuntimeError(f"{value_type} not supported in `push_data_to_grids` function")
+
+    def push_column_to_grids(self,
+                             matched: pd.DataFrame,
+                             value_col: str,
+                             value_key: str | None = None,
+                             how: Literal['sum', 'mean', 'count', 'max', 'min', 'join'] = 'sum',
+                             index_col: str = 'grid_index'):
+        """
+        Aggregate a column of grid matched process (`grid_matching_point` / `grid_matching_line` result)
+            into the `value_key` layer. Rows matched to the same grid are aggregated with `how`,
+            not dropped. See `push_array_to_grids`
+        :param matched: grid index prefixed dataframe
+        :param value_col: column to push
+        :param value_key: layer to write. Same as `value_col` if None
+        :param how: aggregation
+        :param index_col: column of the grid index
+        """
+        assert index_col in matched.columns
+        assert value_col in matched.columns
+
+        self.push_array_to_grids(
+            matched[index_col].to_numpy(),
+            matched[value_col].to_numpy(),
+            value_col if value_key is None else value_key,
+            how
+        )
+
+    def push_array_to_grids(self,
+                            grid_index: np.ndarray,
+                            values: np.ndarray,
+                            value_key: str,
+                            how: Literal['sum', 'mean', 'count', 'max', 'min', 'join'] = 'sum'):
+        """
+        Scatter `values` into the `value_key` layer in one pass. O(rows + grids), no loop over the grids.
+            The layer is replaced with the aggregate of each grid. Missing values are skipped.
+            1. sum, count: grids without process get 0
+            2. mean, max, min: grids without process get NaN (missing)
+            3. join: values joined with a whitespace in order. Grids without process get ""
+        :param grid_index: grid index of each value
+        :param values: values to aggregate
+        :param value_key: layer to write
+        :param how: aggregation
+        """
+        grid_index = np.asarray(grid_index, dtype=np.int64)
+        assert ((0 <= grid_index) & (grid_index < self.size)).all(), "grid index out of the grid"
+        if np.ndim(values) > 1:
+            self.layers[value_key] = self._scatter_channels(grid_index, np.asarray(values, dtype=np.float64), how)
+            return
+
+        values = pd.Series(np.asarray(values))
+        assert len(grid_index) == len(values)
+
+        valid = values.notna().to_numpy()
+        grid_index, values = grid_index[valid], values[valid]
+
+        if how == 'join':
+            layer = np.full(self.size, "", dtype=object)
+            joined = values.astype(str).groupby(grid_index, sort=False).agg(' '.join)
+            layer[joined.index.to_numpy()] = joined.to_numpy()
+            self.layers[value_key] = layer
+            return
+
+        values = values.to_numpy(dtype=np.float64)
+        if how == 'sum':
+            layer = np.bincount(grid_index, weights=values, minlength=self.size)
+        elif how == 'count':
+            layer = np.bincount(grid_index, minlength=self.size).astype(np.float64)
+        elif how == 'mean':
+            total = np.bincount(grid_index, weights=values, minlength=self.size)
+            count = np.bincount(grid_index, minlength=self.size)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                layer = np.where(count > 0, total / count, np.nan)
+        elif how in ('max', 'min'):
+            ufunc, fill = (np.maximum, -np.inf) if how == 'max' else (np.minimum, np.inf)
+            layer = np.full(self.size, fill)
+            ufunc.at(layer, grid_index, values)
+            layer[layer == fill] = np.nan
+        else:
+            raise RuntimeError(f"{how} not supported in `push_array_to_grids` function")
+        self.layers[value_key] = layer
+
+    def _scatter_channels(self, grid_index: np.ndarray, values: np.ndarray, how: str) -> np.ndarray:
+        """
+        `push_array_to_grids` for values with channels, (rows, *channels).
+            Every channel is scattered at once into a (grids, *channels) layer. NaN are skipped per channel
+        """
+        assert len(grid_index) == len(values)
+        channels = values.shape[1:]
+        values = values.reshape(len(values), -1)
+        width = values.shape[1]
+
+        # Grid `g`, channel `c` is the flat bin `g * width + c`
+        flat = (grid_index[:, None] * width + np.arange(width)).ravel()
+        values = values.ravel()
+        valid = ~np.isnan(values)
+        flat, values = flat[valid], values[valid]
+
+        if how in ('sum', 'count', 'mean'):
+            total = np.bincount(flat, weights=values, minlength=self.size * width)
+            count = np.bincount(flat, minlength=self.size * width)
+            if how == 'sum':
+                layer = total
+            elif how == 'count':
+                layer = count.astype(np.float64)
             else:
-                raise RuntimeError(f"{value_type} not supported in `push_data_to_grids` function")
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    layer = np.where(count > 0, total / count, np.nan)
+        elif how in ('max', 'min'):
+            ufunc, fill = (np.maximum, -np.inf) if how == 'max' else (np.minimum, np.inf)
+            layer = np.full(self.size * width, fill)
+            ufunc.at(layer, flat, values)
+            layer[layer == fill] = np.nan
+        else:
+            raise RuntimeError(f"{how} not supported for layers with channels")
+        return layer.reshape((self.size,) + channels)
 
     def trickle_down(self,
                      startings: [GridElement],
                      steps: int,
                      value_key: str,
-                     decay_factors: str,
+                     decay_factors: 'str | DecayKernel | Callable[[int], float]',
                      initial_value: float | None = None):
         """
         Trickle downing can be started from multiple GridElement.
-            For single GridElement the trickle-down effect are applied with for loop
         If there's an initial_value that trickling-down starts from
             use that initial_value and log it in the GridElement's data_single
             using `value_key`.
         However, if there's no initial_value (None), the tricking down starts from the
             value stored in GridElement's data_single found with `value_key`
-        For each loop, `impace_value_name` is assigned as a key to be stored in data_single dictionary.
-        When the for loop is done for all starting GridElement, temporary impact_value_name will be
-            added to a single `value_key`.
+        Every grid gets the sum of the impact of all starting GridElement within `steps`,
+            and 0 if there's none. The sum replaces the `value_key` layer.
+        A layer with channels (e.g. hour x embark/disembark) trickles down every channel at once.
+
+        The impact of a starting point only depends on the (Chebyshev) distance d, the number of
+            BFS steps over the 8 neighbors. It is an affine function of the starting value
+            `value * scale[d] + offset[d]`. So all starting points are applied at once as
+            a (2k + 1) x (2k + 1) kernel convolution over the dense grid, instead of one BFS each.
 
         :param startings: Starting points for trickling down
         :param steps: How many steps to trickkle down.
-            If 10, goes additional 10 GridElements away using BFS
+            If 10, goes additional 10 GridElements away
         :param value_key: (See the main comment)
-        :param decay_factors: Can be either "*<decay element>" or "-<decay element>" or "<decay element>"
+        :param decay_factors: Can be either "*<decay element>" or "-<decay element>" or "<decay element>",
+            a DecayKernel (see `grid.decay`) or a function of the distance returning the multiplier
         :param initial_value:
         """
-        # Set individual trickle down event for value_key Grid wise
-        value_names = set()
-        for i, grid in enumerate(startings):
-            # To prevent `set_data_value` updating the original trickled down value,
-            # Use separate trickle_down_tmp
-            impact_value_name = f"{value_key}_trickle_down_tmp_{i}"
-            value_names.add(impact_value_name)
-            if initial_value is not None:
-                self._single_trickle_down_bfs(
-                    grid,
-                    steps,
-                    impact_value_name,
-                    initial_value,
-                    decay_factors
-                )
-            else:
-                self._single_trickle_down_bfs(
-                    grid,
-                    steps,
-                    impact_value_name,
-                    grid.data_single[value_key],
-                    decay_factors
-                )
-
-        # Sum all the {value_key}_temp_{i} and make it into {value_key}
-        for grid in self.grid_element_map.values():
-            # Sum the temporary value and save it as a value_key
-            sum_value = 0
-            for k, v in grid.data_single.items():
-                if k in value_names:
-                    sum_value += grid.data_single[k]
-            grid.data_single[value_key] = sum_value
-
-            # Delete key after giving it to sum
-            for k in value_names:
-                if k in grid.data_single.keys():
-                    del grid.data_single[k]
-
-    @staticmethod
-    def _decay(current_value: float, decay_factors: str):
-        # Calculate the new value for the next step
-        if "*" in decay_factors:
-            decay = float(decay_factors.replace("*", ''))
-            next_value = current_value * decay
-        elif "-" in decay_factors:
-            decay = float(decay_factors.replace("-", ''))
-            next_value = current_value - decay
+        index = np.fromiter((grid.index for grid in startings), dtype=np.int64)
+        if initial_value is not None:
+            value = np.full(len(index), initial_value, dtype=np.float64)
         else:
-            decay = float(decay_factors)
-            next_value = current_value + decay
-        return next_value
-
-    def _single_trickle_down_bfs(self,
-                                 starting: GridElement,
-                                 steps: int,
-                                 value_key: str,
-                                 value: float,
-                                 decay_factors: str):
-        """
-        Use Breadth to assign value based on the shortest distance from the starting point.
-            BFS explores all the neighbors at the current depth (distance)
-            before moving to the next level.
-        :param starting: Starting point of the trickle down of an impact
-        :param steps: How many steps to trickle down
-        :param value_key: Key to be set inside GridElement's `data_single` dictionary
-        :param value: Value to be set inside GridElement's `data_single` dictionary under key `key`
-        :param decay_factors: should be string in order to make different calculation
-            1. *<number>: value * decay number(float)
-            2. -<number>: value - decay number(float)
-            3. (else): value + decay number(float)
-        :return:
+            value = self.layer(value_key)[index].astype(np.float64)
+            if np.isnan(value).any():
+                raise KeyError(f"{value_key} is missing for some of the starting grids")
+
+        # Grid can't reach further than its own size
+        reach = min(max(int(np.ceil(steps)), 0), max(self.n, self.m) - 1)
+        scale, offset = parse_decay(decay_factors).weights(reach)
+
+        # Sum of the starting values and the number of starting points of each grid
+        # Channels, if any, go to the leading axis: (channels, n, m)
+        channels = value.shape[1:]
+        value = value.reshape(len(index), int(np.prod(channels)))
+        width = value.shape[1]
+        shape = (self.n, self.m)
+        flat = (index[:, None] * width + np.arange(width)).ravel()
+        mass = np.bincount(flat, weights=value.ravel(), minlength=self.size * width)
+        mass = np.moveaxis(mass.reshape(shape + (width,)), -1, 0)
+        count = np.bincount(index, minlength=self.size).reshape(shape)
+
+        total = _fft_convolve(mass, _chebyshev_kernel(scale))
+        if np.any(offset != 0):
+            total += _fft_convolve(count.astype(np.float64), _chebyshev_kernel(offset))
+
+        # Grids out of reach from every starting point are exactly 0
+        total[:, _box_sum(_box_sum(count, reach, -1), reach, -2) == 0] = 0
+        self.layers[value_key] = np.moveaxis(total, 0, -1).reshape((self.size,) + channels)
+
+    def save(self, path: str):
+        """
+        Save the grid as a snapshot directory
+            `grid.json`: geometry (start, boundary, size, n, m) and the layer index
+            `layer_<k>.npy`: one binary column per layer
+        Geometry is rebuilt from the metadata on `load`, so only the layers are stored as arrays.
+        :param path: snapshot directory. Created if it does not exist
         """
-        visited = dict()
-        queue = deque([(starting, steps, value)])
+        os.makedirs(path, exist_ok=True)
+
+        layers = dict()
+        for k, (value_key, layer) in enumerate(self.layers.items()):
+            filename = f"layer_{k}.npy"
+            if layer.dtype == object:
+                # Strings are stored as fixed width unicode. Missing values are saved as ""
+                np.save(os.path.join(path, filename), np.where(np.equal(layer, None), "", layer).astype(str))
+                layers[value_key] = {'file': filename, 'dtype': 'object'}
+            else:
+                np.save(os.path.join(path, filename), layer)
+                layers[value_key] = {'file': filename, 'dtype': str(layer.dtype)}
+
+        meta = {
+            'name': self.name,
+            'grid_name': self.grid_name,
+            'start': list(self.start.coordinate),
+            'boundary': {
+                'left': self.boundary.LEFT.value,
+                'right': self.boundary.RIGHT.value,
+                'up': self.boundary.UP.value,
+                'down': self.boundary.DOWN.value,
+                'bdname': self.boundary.bdname.value,
+            },
+            'size': self.single_size,
+            'n': self.n,
+            'm': self.m,
+            'layers': layers,
+        }
+        with open(os.path.join(path, 'grid.json'), 'w', encoding='utf-8') as file:
+            json.dump(meta, file, ensure_ascii=False, indent=2)
 
-        while queue:
-            current_element, current_steps, current_value = queue.popleft()
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, layers: list[str] | None = None) -> 'Grid':
+        """
+        Load a grid snapshot saved with `save`.
+        :param path: snapshot directory
+        :param mmap: memory-map number layers (copy-on-write) instead of reading them into memory.
+            Only the pages that are actually used are read from the disk
+        :param layers: layers to load. Every layer if None
+        :return: Grid
+        """
+        with open(os.path.join(path, 'grid.json'), encoding='utf-8') as file:
+            meta = json.load(file)
+
+        bd = meta['boundary']
+        grid = cls(
+            Coordinate(*meta['start']),
+            BaseBoundary.create(bd['left'], bd['right'], bd['up'], bd['down'], bd['bdname']),
+            meta['size'],
+            meta['name']
+        )
+        assert (grid.n, grid.m) == (meta['n'], meta['m']), f"snapshot {path} does not match its geometry"
 
-            # Skip if already visited with fewer steps
-            already_visited = current_element.index in visited
-            visited_fewer_steps = (
-                    current_element.index in visited and
-                    visited[current_element.index] <= current_steps
-            )
-            if already_visited or visited_fewer_steps:
+        for value_key, info in meta['layers'].items():
+            if layers is not None and value_key not in layers:
                 continue
 
-            # Update the GridElement's process and mark as visited
-            current_element.set_data_value(value_key, current_value)
-            visited[current_element.index] = current_steps
-
-            # Calculate the new value for the ext step
-            next_value = self._decay(current_value, decay_factors)
-
-            # Add the neighbors to the queue with reduced steps
-            if current_steps > 0:
-                for neighbor in [current_element.north,
-                                 current_element.south,
-                                 current_element.east,
-                                 current_element.west,
-                                 current_element.northeast,
-                                 current_element.northwest,
-                                 current_element.southeast,
-                                 current_element.southwest]:
-                    if neighbor is not None:
-                        queue.append((neighbor, current_steps - 1, next_value))
-
-    def grid_dataframe(self, target: str) -> pd.DataFrame:
-        """
-        If `target` key is inside the grid map's GridElement's data_single dictionary
-            display it as a dataframe.
+            filename = os.path.join(path, info['file'])
+            if info['dtype'] == 'object':
+                grid.layers[value_key] = np.load(filename).astype(object)
+            else:
+                grid.layers[value_key] = np.load(filename, mmap_mode='c' if mmap else None)
+        return grid
+
+    def grid_dataframe(self, target: str, channel: int | tuple | None = None) -> pd.DataFrame:
+        """
+        If `target` layer is inside the grid, display it as a (n, m) dataframe.
+            Number layers are a reshaped view of the layer, not a copy.
         You can easily check the corresponding Grid's process.
-        :param target: key for dictionary `data_single`
+        :param target: key for the layer (`data_single`)
+        :param channel: channel to display, for a layer with channels. e.g. (8, 1)
+        :return: pandas dataframe
+        """
+        if target not in self.layers:
+            return pd.DataFrame(np.full((self.n, self.m), np.nan))
+
+        layer = self.layers[target]
+        if layer.ndim > 1:
+            assert channel is not None, f"{target} has channels {layer.shape[1:]}. Pick one"
+            layer = layer[(slice(None),) + tuple(np.atleast_1d(channel))]
+        if layer.dtype == object:
+            layer = np.where(np.equal(layer, None), np.nan, layer)
+        return pd.DataFrame(layer.reshape(self.n, self.m), copy=False)
+
+    def kepler_dataframe(self, targets: [str], save: bool = True, output_dir: str | None = None) -> pd.DataFrame:
+        """
+        One row per grid with the `targets` layers and the grid's center coordinate.
+            A layer with channels gives one column per channel, `<target>_<channel>`.
+        :param targets: layers to export
+        :param save: save as `<grid_name>.csv` under `output_dir`
+        :param output_dir: directory to save. `generate` directory of the project if None
         :return: pandas dataframe
         """
-        result = list()
-        for i in range(self.n):
-            rows = list()
-            for j in range(self.m):
-                grid_index = i * self.m + j
-                grid_data = self.grid_element_map[grid_index].data_single
-
-                if target in grid_data.keys():
-                    rows.append(grid_data[target])
-                else:
-                    rows.append(np.nan)
-            result.append(rows)
-
-        return pd.DataFrame(result)
-
-    def kepler_dataframe(self, targets: [str], save: bool = True) -> pd.DataFrame:
-        result = list()
-        col = ['grid_index', *targets, 'lon', 'lat']
-        for k, v in self.grid_element_map.items():
-            row = [k, *[v.data_single[tgt] for tgt in targets], *v.center.coordinate]
-            result.append(row)
-
-        result = pd.DataFrame(result, columns=col)
+        columns = {'grid_index': np.arange(self.size)}
+        for tgt in targets:
+            layer = self.layers[tgt]
+            if layer.ndim == 1:
+                columns[tgt] = layer
+                continue
+            for channel in np.ndindex(layer.shape[1:]):
+                columns[f"{tgt}_{'_'.join(map(str, channel))}"] = layer[(slice(None),) + channel]
+        columns['lon'] = self.center_lon
+        columns['lat'] = self.center_lat
+
+        result = pd.DataFrame(columns, copy=False)
         if save:
-            filename = f"/Users/goonzard/Developer/portfolio-realestate/generate/{self.grid_name}.csv"
-            result.to_csv(filename)
+            output_dir = GENERATE_PATH if output_dir is None else output_dir
+            os.makedirs(output_dir, exist_ok=True)
+            result.to_csv(os.path.join(output_dir, f"{self.grid_name}.csv"))
         return result
 
 
-def grid_matching_point(grid: Grid, data: pd.DataFrame, lon_lat_col_name: (str, str), verbose: bool = False):
-    lon_col, lat_col = lon_lat_col_name
-    assert lon_col in data.columns
-    assert lat_col in data.columns
+def _chebyshev_kernel(weights: np.ndarray) -> np.ndarray:
+    """
+    (2k + 1) x (2k + 1) kernel whose cell d steps away (Chebyshev distance) from the center is weights[d]
+    """
+    reach = len(weights) - 1
+    distance = np.abs(np.arange(-reach, reach + 1))
+    return weights[np.maximum(distance[:, None], distance[None, :])]
 
-    # Return only the grid - matched process points
-    data_np = data.to_numpy()
 
-    result = list()
-    for i, (lon, lat) in enumerate(zip(data[lon_lat_col_name[0]], data[lon_lat_col_name[1]])):
-        if verbose:
-            print(f"matching grid for {data_np[i][0]}", flush=True)
+def _fft_convolve(field: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    """
+    Linear convolution of `field` with an odd sized, centered `kernel` over the last two axes.
+        Result has the same shape as `field`. Leading axes are convolved independently.
+    """
+    n, m = field.shape[-2:]
+    kn, km = kernel.shape
+    shape = (n + kn - 1, m + km - 1)
+
+    spectrum = np.fft.rfft2(field, shape) * np.fft.rfft2(kernel, shape)
+    full = np.fft.irfft2(spectrum, shape)
+    return full[..., kn // 2:kn // 2 + n, km // 2:km // 2 + m]
+
+
+def _box_sum(field: np.ndarray, reach: int, axis: int) -> np.ndarray:
+    """
+    Sum of `field` within `reach` cells along `axis` (inclusive), in O(size) with a cumulative sum
+    """
+    length = field.shape[axis]
+    cumulative = np.cumsum(field, axis=axis)
+    cumulative = np.concatenate([np.zeros_like(np.take(cumulative, [0], axis=axis)), cumulative], axis=axis)
+
+    position = np.arange(length)
+    upper = np.minimum(position + reach + 1, length)
+    lower = np.maximum(position - reach, 0)
+    return np.take(cumulative, upper, axis=axis) - np.take(cumulative, lower, axis=axis)
 
-        for ge in grid.grid_element_map.values():
-            if ge.has(lon, lat):
-                result.append([ge.index, *data_np[i]])
-                break  # one coordinate can only match one grid (not intersecting)
 
-    return pd.DataFrame(result, columns=['grid_index', *data.columns])
+def grid_matching_point(grid: Grid, data: pd.DataFrame, lon_lat_col_name: (str, str), verbose: bool = False):
+    lon_col, lat_col = lon_lat_col_name
+    assert lon_col in data.columns
+    assert lat_col in data.columns
 
+    # Row and column of every point are computed at once. See `Grid.locate`
+    grid_index = grid.locate(
+        data[lon_col].to_numpy(dtype=np.float64, na_value=np.nan),
+        data[lat_col].to_numpy(dtype=np.float64, na_value=np.nan)
+    )
+    matched = grid_index >= 0
+    if verbose:
+        print(f"matched {matched.sum()} of {len(data)} points to grid {grid.grid_name}", flush=True)
 
-def grid_matching_line(grid: Grid, data: pd.DataFrame, line_segs_col_name: str, verbose: bool = False):
+    # Return only the grid - matched process points
+    result = pd.DataFrame(data.loc[matched]).reset_index(drop=True)
+    result.insert(0, 'grid_index', grid_index[matched])
+    return result
+
+
+def grid_matching_line(grid: Grid,
+                       data: pd.DataFrame,
+                       line_segs_col_name: str,
+                       verbose: bool = False,
+                       length_col_name: str | None = None):
+    """
+    Match every line of every row to all the grids it passes through.
+        Lines are queried against `Grid.cell_tree` in bulk, instead of testing every grid for every line.
+    There can be multiple grids matched, so the returning dataframe might be bumped up.
+        One row per (line, grid) pair, ordered by input row, line and grid index.
+    :param grid: Grid
+    :param data: process with a column of LineString lists
+    :param line_segs_col_name: column with the list of LineString of each row
+    :param verbose:
+    :param length_col_name: if given, add a column with the length (meter) of the line inside the grid
+    :return: grid_index-prefixed dataframe without the line column
+    """
     assert line_segs_col_name in data.columns
 
     # Return only the grid - matched line. Drop the line
     cols_no_line = data.columns.tolist()
     cols_no_line.remove(line_segs_col_name)
-    data_np = data[cols_no_line].to_numpy()
-
-    result = list()
-    for i, line_segs in enumerate(data[line_segs_col_name]):
-        if verbose:
-            print(f"matching grid for {data_np[i][0]}", flush=True)
-
-        # Multiple line in line_segs
-        # If one of the line is matched, save the grid
-        # There can be multiple grids matched, so the returning dataframe might be bumped up
-        for line in line_segs:
-            for ge in grid.grid_element_map.values():
-                if ge.pass_through(line):
-                    result.append([ge.index, *data_np[i]])
 
-    return pd.DataFrame(result, columns=['grid_index', *cols_no_line])
+    # Multiple line in line_segs. Flatten them and remember the row they came from
+    line_segs = data[line_segs_col_name].tolist()
+    lines = np.array([line for segs in line_segs for line in segs], dtype=object)
+    line_row = np.repeat(np.arange(len(data)), [len(segs) for segs in line_segs])
+
+    # `contains` implies `intersects`, so a single predicate covers both
+    line_index, grid_index = grid.cell_tree.query(lines, predicate='intersects')
+    order = np.lexsort((grid_index, line_index))
+    line_index, grid_index = line_index[order], grid_index[order]
+    if verbose:
+        print(f"matched {len(lines)} lines to {len(grid_index)} grids of {grid.grid_name}", flush=True)
+
+    result = pd.DataFrame(data[cols_no_line].iloc[line_row[line_index]]).reset_index(drop=True)
+    result.insert(0, 'grid_index', grid_index.astype(np.int64))
+    if length_col_name is not None:
+        inside = shapely.intersection(lines[line_index], grid.cell_tree.geometries[grid_index])
+        result[length_col_name] = geodesic_length(inside)
+    return result
+
+
+def geodesic_length(geometries: np.ndarray) -> np.ndarray:
+    """
+    Length (meter) of every (multi) line geometry on the WGS84 ellipsoid.
+        Points and empty geometries have length 0.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    parts, part_owner = shapely.get_parts(geometries, return_index=True)
+    coords, coord_owner = shapely.get_coordinates(parts, return_index=True)
+
+    # Segments are consecutive coordinates of the same part
+    same_part = coord_owner[1:] == coord_owner[:-1]
+    _, _, distance = GEOD.inv(
+        coords[:-1, 0][same_part], coords[:-1, 1][same_part],
+        coords[1:, 0][same_part], coords[1:, 1][same_part]
+    )
+    part_length = np.bincount(coord_owner[1:][same_part], weights=distance, minlength=len(parts))
+    return np.bincount(part_owner, weights=part_length, minlength=len(geometries))
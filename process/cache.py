@@ -0,0 +1,135 @@
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from shapely.geometry.base import BaseGeometry
+
+from process.loader import Loader
+
+from typing import Callable
+import hashlib
+import json
+import os
+
+
+def shapefile_sources(filename: str) -> list[str]:
+    """
+    Shapefile comes with its `dbf, prj, shx` etc. files. Return all of them that exist
+    """
+    base = os.path.splitext(filename)[0]
+    return [filename] + [f"{base}.{ext}" for ext in ('shx', 'dbf', 'prj', 'cpg') if os.path.exists(f"{base}.{ext}")]
+
+
+class ProcessedCache:
+    """
+    On-disk cache of cleaned process data.
+        Each entry is a parquet file (GeoParquet for GeoDataFrame) keyed by
+        its name, the path, size and modification time of every source file,
+        and a version tag of the cleaning code. Change any of them and the entry is rebuilt.
+        Least recently used entries are dropped once the directory grows over `max_bytes`.
+
+    :param directory: where the entries are kept. Defaults to `asset/cache`
+    :param max_bytes: size cap of the directory
+    """
+    def __init__(self, directory: str = None, max_bytes: int = 2 * 1024 ** 3):
+        if directory is None:
+            loader = Loader()
+            loader.set_path("./asset/cache")
+            directory = loader.path
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(name: str, sources: list[str], version: str) -> str:
+        stamp = [name, version]
+        for source in sources:
+            stat = os.stat(source)
+            stamp.append([os.path.abspath(source), stat.st_size, stat.st_mtime_ns])
+        return hashlib.sha1(json.dumps(stamp).encode()).hexdigest()[:16]
+
+    def filename(self, name: str, key: str) -> str:
+        return os.path.join(self.directory, f"{name}-{key}.parquet")
+
+    def load(self,
+             name: str,
+             sources: str | list[str],
+             build: Callable[[], pd.DataFrame],
+             version: str = '1') -> pd.DataFrame:
+        """
+        Return the cached entry, or build, store and return it.
+        :param name: entry name. One file per name is kept
+        :param sources: source file(s) the entry is built from
+        :param build: function that builds the entry from the sources
+        :param version: tag of the cleaning code. Bump it when `build` changes its output
+        """
+        if isinstance(sources, str):
+            sources = [sources]
+        filename = self.filename(name, self.key(name, sources, version))
+
+        if os.path.exists(filename):
+            os.utime(filename)  # Mark as recently used
+            return self._read(filename)
+
+        data = build()
+        self.invalidate(name)
+        if self._write(data, filename):
+            self._evict(keep=filename)
+        return data
+
+    def invalidate(self, name: str = None):
+        """
+        Remove entries of `name`, or every entry if `name` is not given
+        """
+        for filename in self._entries():
+            if name is None or os.path.basename(filename).rsplit('-', 1)[0] == name:
+                os.remove(filename)
+
+    def _entries(self) -> list[str]:
+        return [os.path.join(self.directory, f)
+                for f in os.listdir(self.directory)
+                if f.endswith('.parquet')]
+
+    def _evict(self, keep: str):
+        # Least recently used first
+        entries = sorted(self._entries(), key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in entries)
+        for filename in entries:
+            if total <= self.max_bytes:
+                break
+            if filename == keep:
+                continue
+            total -= os.path.getsize(filename)
+            os.remove(filename)
+
+    @staticmethod
+    def _write(data: pd.DataFrame, filename: str) -> bool:
+        """
+        Store the entry. Data parquet can't hold (e.g. an object column of both ints and strings)
+            is not cached, and False is returned
+        """
+        if isinstance(data, gpd.GeoDataFrame):
+            # Columns of shapely objects (e.g. from `apply`) are written as geometry too
+            for col in data.columns:
+                values = data[col].dropna()
+                if data[col].dtype == object and len(values) and isinstance(values.iloc[0], BaseGeometry):
+                    data = data.assign(**{col: gpd.GeoSeries(data[col], crs=data.crs)})
+
+        # Write aside and move in place, so an interrupted write never leaves a broken entry
+        temp = f"{filename}.tmp"
+        try:
+            data.to_parquet(temp)
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            print(f"{os.path.basename(filename)} is not cached: {e}")
+            if os.path.exists(temp):
+                os.remove(temp)
+            return False
+        os.replace(temp, filename)
+        return True
+
+    @staticmethod
+    def _read(filename: str) -> pd.DataFrame:
+        metadata = pq.read_schema(filename).metadata or {}
+        if b'geo' in metadata:
+            return gpd.read_parquet(filename)
+        return pd.read_parquet(filename)
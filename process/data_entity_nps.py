@@ -4,51 +4,95 @@ import requests
 from dotenv import load_dotenv
 
 from process.loader import Loader
+from process.cache import ProcessedCache
+from process.geocode import clean_address
 
-from typing import Tuple
+from functools import cached_property
 import os
 import re
 
 
 class NPS:
-    def __init__(self):
-        self.data = self.load_data()
+    # Columns of the raw NPS file, in order
+    columns = [
+        'data_gen_dt', 'business', 'business_nps_reg_code', 'business_reg_stat',
+        'postcode', 'j_addr', 'r_addr', 'bjd', 'hjd', 'bjd_district', 'bjd_sgg', 'bjd_emd',
+        'business_own', 'business_type', 'business_type_nm',
+        'nps_dt', 're_reg', 'exit_reg', 'ppl', 'amount', 'ppl_new', 'ppl_exit'
+    ]
+
+    # Essential columns and their types. Only these are parsed
+    # Integers are parsed as float (parsing nullable Int64 is slow) and cast once cleaned
+    essential_dtypes = {
+        'business': 'str',
+        'business_reg_stat': 'float64',
+        'j_addr': 'str',
+        'r_addr': 'str',
+        'bjd': 'category',
+        'hjd': 'category',
+        'business_own': 'float64',
+        'business_type_nm': 'category',
+        'ppl': 'float64',
+        'amount': 'float64',
+    }
+    integer_columns = ['business_reg_stat', 'business_own', 'ppl', 'amount']
+
+    # Bump when the cleaning below changes its output
+    cache_version = '1'
+
+    def __init__(self, chunksize: int = 100000, cache: bool = True):
+        self.data = self.load_data(chunksize, cache)
 
     @staticmethod
-    def load_data():
+    def load_data(chunksize: int = 100000, cache: bool = True):
+        """
+        Load NPS data of Seoul.
+            The national file is read `chunksize` rows at a time, and each chunk is
+            cleaned before the next one is read - only Seoul stays in memory.
+        :param chunksize: number of rows read at once
+        :param cache: reuse the cleaned result from `ProcessedCache` while the source file is unchanged
+        """
         # Load NPS process
         loader = Loader()
         loader.set_path("./asset/entity_wage")
-        data = pd.read_csv(loader.data_filename_nps(), encoding='cp949')
-
-        # Clean process - pick essential column
-        cols = [
-            'data_gen_dt', 'business', 'business_nps_reg_code', 'business_reg_stat',
-            'postcode', 'j_addr', 'r_addr', 'bjd', 'hjd', 'bjd_district', 'bjd_sgg', 'bjd_emd',
-            'business_own', 'business_type', 'business_type_nm',
-            'nps_dt', 're_reg', 'exit_reg', 'ppl', 'amount', 'ppl_new', 'ppl_exit'
-        ]
+        filename = loader.data_filename_nps()
+
+        def _build():
+            # Clean process - pick essential column
+            reader = pd.read_csv(
+                filename,
+                encoding='cp949',
+                header=0,
+                names=NPS.columns,
+                usecols=list(NPS.essential_dtypes),
+                dtype=NPS.essential_dtypes,
+                chunksize=chunksize
+            )
+            data = pd.concat([NPS.clean_chunk(chunk) for chunk in reader], ignore_index=True)
+
+            # Categories differ chunk by chunk. Concatenated they fall back to object
+            data = data.astype({c: 'category' for c, t in NPS.essential_dtypes.items() if t == 'category'})
+            data = data.astype({c: 'Int64' for c in NPS.integer_columns})
+            return data
+
+        if cache:
+            return ProcessedCache().load('nps', filename, _build, NPS.cache_version)
+        return _build()
 
-        essential_cols = [
-            'business', 'business_reg_stat', 'j_addr', 'r_addr', 'bjd', 'hjd',
-            'business_own', 'business_type_nm', 'ppl', 'amount'
-        ]
-
-        data.columns = cols
-        data = data[essential_cols]
+    @staticmethod
+    def clean_chunk(data: pd.DataFrame) -> pd.DataFrame:
+        # Column order of the original file
+        data = data[list(NPS.essential_dtypes)]
 
         # Clean process - pick only seoul process
-        data = data.loc[data['j_addr'].str.contains('서울특별시')]
+        data = data.loc[data['j_addr'].str.contains('서울특별시', na=False)]
 
-        # Clean process - drop paper company (SPC etc.)
-        pattern = r'\d'
-        data = data[~data['business'].str.contains('/', na=False)]
-        data = data[~data['business'].str.contains('학교', na=False)]
-        data = data[~data['business'].str.contains('조합', na=False)]
-        data = data[~data['business'].str.contains(pattern, na=False)]
+        # Clean process - drop paper company (SPC etc.), school, union and names with digits
+        pattern = r'/|학교|조합|\d'
+        data = data.loc[~data['business'].str.contains(pattern, na=False)]
 
         # Clean process - huristic.
-        data['ppp'] = data['amount'] / data['ppl']
+        data = data.assign(ppp=data['amount'] / data['ppl'])
         data = data.loc[data['ppp'] >= 370490]  # Drop average NPS payment under 370,490 - 평균 연봉 1억
         data = data.loc[data['ppl'] >= 100]  # Drop business that has less than 100 employees.
 
@@ -79,147 +123,189 @@ class NPS:
 class CollectEntityCoordinate:
     # Merge NPS entity with main
     # Merge NPS
-    def __init__(self):
+    # Bump when the cleaning below changes its output
+    cache_version = '1'
+
+    def __init__(self, cache: bool = True):
         # DART code process
-        self.data = self.load_data(use_collected=True)
+        self.data = self.load_data(use_collected=True, cache=cache)
 
     @staticmethod
-    def load_data(use_collected: bool = True):
+    def load_data(use_collected: bool = True, cache: bool = True):
         loader = Loader()
         loader.set_path("./asset/entity_dart")
         if use_collected:
-            data = pd.read_csv(loader.data_filename_collected())
+            filename = loader.data_filename_collected()
+            name, read = 'dart_collected', lambda: pd.read_csv(filename)
         else:
-            data = pd.read_csv(loader.data_filename_dart(), index_col=0)
-        return data
+            filename = loader.data_filename_dart()
+            name, read = 'dart', lambda: pd.read_csv(filename, index_col=0)
+
+        if cache:
+            return ProcessedCache().load(name, filename, read, CollectEntityCoordinate.cache_version)
+        return read()
 
     # Business name cleaning will be done by multiple stages
     # After each stage you try to match the name.
+    # Remove company types (after white spaces)
+    stg1_pattern = re.compile('|'.join(map(re.escape, [
+        '（주）',  # Different (주)
+        '(주)', '(주）', '(재)', '(사)', '(유)', '(유한)', '(특수법인)', '(직장)',
+        '본사', '국내', '해외', '주식회사', '유한회사'
+    ])))
+
+    # Replace English company name into Korean
+    stg2_table = str.maketrans({
+        'A': '에이', 'B': '비', 'C': '씨', 'D': '디', 'E': '이',
+        'F': '에프', 'G': '지', 'H': '에이치', 'I': '아이', 'J': '제이',
+        'K': '케이', 'L': '엘', 'M': '엠', 'N': '엔', 'O': '오', 'P': '피',
+        'Q': '큐', 'R': '알', 'S': '에스', 'T': '티', 'U': '유', 'V': '브이',
+        'W': '더블유', 'X': '엑스', 'Y': '와이', 'Z': '지'
+    })
+
+    # Change targeted name - SK, LG, 기업은행 등
+    # From NPS -> DART. Applied in order: the replacements overlap (지에스케이), so no single alternation
+    stg3_specific = {
+        '중소기업은행': '기업은행',
+        '신한금융지주회사': '신한지주',
+        'KB금융지주': 'KB금융',
+        '에쓰-오일': 'S-Oil',
+        '뱅크오브아메리카': '아메리카은행',
+        '한화생명보험': '한화생명',
+        '한국생산성본부': '한국생산성본부인증원',
+
+        # LG Group
+        '엘지': 'LG',
+
+        # SK Group
+        '에스케이': 'SK',
+
+        # GS Group
+        '지에스': 'GS',
+
+        # NICE Group
+        '나이스': 'NICE'
+    }
+
+    # Column names of the stage keys, in the order they are tried
+    name_key_columns = ['corpNm1', 'corpNm2', 'corpNm3']
+
     @staticmethod
     def clean_name_stg1(val: str):
         # Remove company types and white spaces
-        s = str(val)
-        s = (s.replace(' ', '').
-             replace('（주）', '').  # Different (주)
-             replace('(주)', '').
-             replace('(주）', '').
-             replace('(재)', '').
-             replace('(사)', '').
-             replace('(유)', '').
-             replace('(유한)', '').
-             replace('(특수법인)', '').
-             replace('(직장)', '').
-             replace('본사', '').
-             replace('국내', '').
-             replace('해외', '').
-             replace('주식회사', '').
-             replace('유한회사', ''))
-        return s
+        s = str(val).replace(' ', '')
+        return CollectEntityCoordinate.stg1_pattern.sub('', s)
 
     @staticmethod
     def clean_name_stg2(val: str):
         # Replace English company name into Korean
-        rep = {
-            'A': '에이', 'B': '비', 'C': '씨', 'D': '디', 'E': '이',
-            'F': '에프', 'G': '지', 'H': '에이치', 'I': '아이', 'J': '제이',
-            'K': '케이', 'L': '엘', 'M': '엠', 'N': '엔', 'O': '오', 'P': '피',
-            'Q': '큐', 'R': '알', 'S': '에스', 'T': '티', 'U': '유', 'V': '브이',
-            'W': '더블유', 'X': '엑스', 'Y': '와이', 'Z': '지'
-        }
-        s = str(val)
-        for alp, kor in rep.items():
-            s = s.replace(alp, kor)
-        return s
+        return str(val).translate(CollectEntityCoordinate.stg2_table)
 
     @staticmethod
     def clean_name_stg3(val: str):
         # Change targeted name - SK, LG, 기업은행 등
-        # From NPS -> DART
-        specific = {
-            '중소기업은행': '기업은행',
-            '신한금융지주회사': '신한지주',
-            'KB금융지주': 'KB금융',
-            '에쓰-오일': 'S-Oil',
-            '뱅크오브아메리카': '아메리카은행',
-            '한화생명보험': '한화생명',
-            '한국생산성본부': '한국생산성본부인증원',
-
-            # LG Group
-            '엘지': 'LG',
-
-            # SK Group
-            '에스케이': 'SK',
-
-            # GS Group
-            '지에스': 'GS',
-
-            # NICE Group
-            '나이스': 'NICE'
-        }
         s = str(val)
-        for fuckups, dart_standard in specific.items():
+        for fuckups, dart_standard in CollectEntityCoordinate.stg3_specific.items():
             s = s.replace(fuckups, dart_standard)
         return s
 
     @staticmethod
-    def clean_duplicate(data: pd.DataFrame, full_address: str, part_address: (str, str)):
+    def clean_name_keys(names: pd.Series) -> pd.DataFrame:
+        """
+        Normalize every name once into all the stage keys.
+            Each stage builds on the previous one: stage 2 key is stage 1 and 2 applied, etc.
+        :param names: business names
+        :return: DataFrame with `name_key_columns`, same index as `names`
+        """
+        cls = CollectEntityCoordinate
+        key1 = (names.astype(str)
+                .str.replace(' ', '', regex=False)
+                .str.replace(cls.stg1_pattern, '', regex=True))
+        key2 = key1.str.translate(cls.stg2_table)
+        key3 = key2
+        for fuckups, dart_standard in cls.stg3_specific.items():
+            key3 = key3.str.replace(fuckups, dart_standard, regex=False)
+        return pd.DataFrame(dict(zip(cls.name_key_columns, (key1, key2, key3))), index=names.index)
+
+    @staticmethod
+    def clean_duplicate(data: pd.DataFrame, full_address: str, part_address: (str, str)) -> pd.DataFrame:
+        """
+        Keep rows whose full address (DART) contains either the land or the road address (NPS).
+            Whitespaces are ignored. Missing addresses never match.
+        """
         land_addr, road_addr = part_address
 
-        data_np = data.to_numpy()
+        def _stripped(col: str) -> np.ndarray:
+            stripped = data[col].fillna('').astype(str).str.replace(' ', '', regex=False)
+            return stripped.to_numpy(dtype=object).astype(str)
 
-        no_dup = list()
-        for idx, addr in enumerate(data[[full_address, land_addr, road_addr]].to_numpy()):
-            full, land, road = addr
-            condition_land = land.replace(' ', '') in full.replace(' ', '')
-            condition_road = road.replace(' ', '') in full.replace(' ', '')
-            if condition_land or condition_road:
-                no_dup.append(data_np[idx])
-        return pd.DataFrame(no_dup, columns = data.columns)
+        full = _stripped(full_address)
+        valid = data[full_address].notna().to_numpy()
+        keep = np.zeros(len(data), dtype=bool)
+        for part in (land_addr, road_addr):
+            found = np.char.find(full, _stripped(part)) >= 0
+            keep |= found & valid & data[part].notna().to_numpy()
+        return data.loc[keep]
+
+    @cached_property
+    def dart_index(self) -> (pd.Index, np.ndarray, np.ndarray):
+        """
+        Hash index of DART `corpNm`, built once.
+            Only rows with an address are indexed - the others can never be a match.
+        :return: unique names, DART row positions grouped by name, and start of each group
+            (rows of name `k` are `rows[starts[k]:starts[k + 1]]`)
+        """
+        usable = np.flatnonzero(self.data['address'].notna() & self.data['corpNm'].notna())
+        codes, names = pd.factorize(self.data['corpNm'].iloc[usable])
+        order = np.argsort(codes, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(names)))])
+        return pd.Index(names), usable[order], starts
+
+    def match(self, nps: pd.DataFrame) -> pd.DataFrame:
+        """
+        Match NPS rows with DART in one pass.
+            Stage 1, 2, 3 keys are probed in order and the first one found wins.
+            A name listed several times in DART gives one row per listing.
+        :param nps: NPS data with `name_key_columns`
+        :return: matched rows, NPS columns followed by DART columns.
+            `corpNm` is the matched name and `stage` the stage (1, 2, 3) it was found at.
+            Sorted by stage, then in NPS order
+        """
+        names, rows, starts = self.dart_index
+
+        code = np.full(len(nps), -1, dtype=np.int64)
+        stage = np.zeros(len(nps), dtype=np.int64)
+        for s, key in enumerate(self.name_key_columns, start=1):
+            todo = np.flatnonzero(code < 0)
+            found = names.get_indexer(nps[key].iloc[todo])
+            hit = todo[found >= 0]
+            code[hit] = found[found >= 0]
+            stage[hit] = s
+
+        matched = np.flatnonzero(code >= 0)
+        matched = matched[np.argsort(stage[matched], kind='stable')]
+
+        # Expand every matched NPS row into its DART rows
+        first, count = starts[code[matched]], np.diff(starts)[code[matched]]
+        nps_pos = np.repeat(matched, count)
+        within = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        dart_pos = rows[np.repeat(first, count) + within]
+
+        left = nps.iloc[nps_pos].reset_index(drop=True)
+        left['corpNm'] = names[code[nps_pos]]
+        left['stage'] = stage[nps_pos]
+        right = self.data.iloc[dart_pos].drop(columns='corpNm').reset_index(drop=True)
+        return pd.merge(left, right, left_index=True, right_index=True)
 
     def clean(self, nps_data: pd.DataFrame) -> pd.DataFrame:
         nps = nps_data.copy(deep=True)
-        nps['corpNm'] = nps['business']
+        nps[self.name_key_columns] = self.clean_name_keys(nps['business'])
 
-        col = nps.columns
         post_clean_col = ['corpNm', 'address', 'ppl', 'amount', 'ppp']
 
-        s1, f1 = self._try1(nps)  # First clean up
-        s2, f2 = self._try2(f1[col])  # Second clean up (First clean up cumulative)
-        s3, _ = self._try3(f2[col])  # Third clean up
-
-        s1 = self.clean_duplicate(s1, 'address', ('j_addr', 'r_addr'))[post_clean_col]
-        s2 = self.clean_duplicate(s2, 'address', ('j_addr', 'r_addr'))[post_clean_col]
-        s3 = self.clean_duplicate(s3, 'address', ('j_addr', 'r_addr'))[post_clean_col]
-
-        clean = pd.concat([s1, s2, s3]).reset_index(drop=True)
-        return clean
-
-    def _try1(self, data: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
-        data.loc[:, 'corpNm'] = data['corpNm'].apply(self.clean_name_stg1)
-        mrg = pd.merge(data, self.data, on=['corpNm'], how='left')
-
-        success = mrg.loc[mrg['address'].notna()]
-        fail = mrg.loc[mrg['address'].isna()]
-        return success, fail
-
-    def _try2(self, data: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
-        data.loc[:, 'corpNm'] = data['corpNm'].apply(self.clean_name_stg1)
-        data.loc[:, 'corpNm'] = data['corpNm'].apply(self.clean_name_stg2)
-        mrg = pd.merge(data, self.data, on=['corpNm'], how='left')
-
-        success = mrg.loc[mrg['address'].notna()]
-        fail = mrg.loc[mrg['address'].isna()]
-        return success, fail
-
-    def _try3(self, data: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
-        data.loc[:, 'corpNm'] = data['corpNm'].apply(self.clean_name_stg1)
-        data.loc[:, 'corpNm'] = data['corpNm'].apply(self.clean_name_stg2)
-        data.loc[:, 'corpNm'] = data['corpNm'].apply(self.clean_name_stg3)
-        mrg = pd.merge(data, self.data, on=['corpNm'], how='left')
-
-        success = mrg.loc[mrg['address'].notna()]
-        fail = mrg.loc[mrg['address'].isna()]
-        return success, fail
+        matched = self.match(nps)
+        clean = self.clean_duplicate(matched, 'address', ('j_addr', 'r_addr'))[post_clean_col]
+        return clean.reset_index(drop=True)
 
     @staticmethod
     def address_to_coord(addr: str, verbose: bool = False):
@@ -227,9 +313,7 @@ class CollectEntityCoordinate:
         Return the coordinates tuple of given full address
         """
         # Strip address of brackets substring and whitespaces
-        clean_addr = (re.sub(r'\(.*?\)', '', addr)
-                      .strip()
-                      .replace('  ', ' '))
+        clean_addr = clean_address(addr)
         if verbose:
             print(f"Query vworld for {clean_addr}")
 
@@ -1,46 +1,235 @@
 import pandas as pd
+import numpy as np
 
 from process.loader import Loader
+from process.cache import ProcessedCache
 from util import clean_remove_bracket, clean_subway_line_name
 
+import json
+import os
+import re
+
 
 class FloatPopulationSubwayTime:
-    def __init__(self, usage_month: int | None = None):
+    # Bump when the cleaning below changes its output
+    cache_version = '1'
+
+    def __init__(self, usage_month: int | None = None, cache: bool = True):
         # Population process
-        self.data = self.load_data()
+        self.data = self.load_data(cache)
         if usage_month is not None:
             print(f"Using only {usage_month} data")
             self.data = self.data.loc[self.data['사용월'] == usage_month]
 
     @staticmethod
-    def load_data():
+    def load_data(cache: bool = True):
         # Load population process
         loader = Loader()
         loader.set_path("./asset/float_subway_time")
-        data = pd.read_csv(loader.data_filename_subway_time(), encoding='euc-kr')
+        filename = loader.data_filename_subway_time()
 
-        # Clean process
-        data = clean_remove_bracket(data)
-        data = clean_subway_line_name(data, '호선명')
+        def _build():
+            data = pd.read_csv(filename, encoding='euc-kr')
 
-        return data
+            # Clean process
+            data = clean_remove_bracket(data)
+            data = clean_subway_line_name(data, '호선명')
+            return data
 
-    def get_timely_data(self, hour: int) -> pd.DataFrame:
-        def _pad(val: int, standard: int = 2):
-            s = str(val)
-            if len(s) < standard:
-                return f"0{val}"
-            else:
-                return str(val)
+        if cache:
+            return ProcessedCache().load('subway_time', filename, _build, FloatPopulationSubwayTime.cache_version)
+        return _build()
+
+    @staticmethod
+    def time_label(hour: int) -> str:
+        # 8 -> 08시-09시
+        return f"{hour:02d}시-{hour + 1:02d}시"
 
+    def get_timely_data(self, hour: int) -> pd.DataFrame:
         assert 0 <= hour < 24
-        embark = f"{_pad(hour)}시-{_pad(hour+1)}시 승차인원"
-        disembark = f"{_pad(hour)}시-{_pad(hour+1)}시 하차인원"
+        label = self.time_label(hour)
+        embark = f"{label} 승차인원"
+        disembark = f"{label} 하차인원"
 
         segment = self.data[['사용월', '호선명', '지하철역', embark, disembark]]
-        segment.columns = ['date', 'line', 'stn', 'embark', 'disembark']
-        segment['time'] = [f"{_pad(hour)}시-{_pad(hour+1)}시"] * len(segment)
-        return segment
+        segment = segment.set_axis(['date', 'line', 'stn', 'embark', 'disembark'], axis=1)
+        return segment.assign(time=label)
+
+    @staticmethod
+    def hourly_array(data: pd.DataFrame) -> np.ndarray:
+        """
+        Hourly profile of every row as a (rows, 24, 2) array: hour x (embark, disembark).
+            Works on any frame with the hourly columns, e.g. after location matching.
+            Hours the source does not have are NaN.
+        """
+        columns = [f"{FloatPopulationSubwayTime.time_label(h)} {kind}"
+                   for h in range(24) for kind in ('승차인원', '하차인원')]
+        return data.reindex(columns=columns).to_numpy(dtype=np.float64).reshape(len(data), 24, 2)
+
+    def get_hourly_data(self) -> pd.DataFrame:
+        """
+        Every hour at once, in long form: one row per station, month and hour.
+            Same columns as `get_timely_data`. `time` is categorical, ordered by hour.
+            Hours the source does not have are left out.
+        """
+        labels = [self.time_label(h) for h in range(24)
+                  if {f"{self.time_label(h)} 승차인원", f"{self.time_label(h)} 하차인원"} <= set(self.data.columns)]
+        embark = self.data[[f"{label} 승차인원" for label in labels]].to_numpy()
+        disembark = self.data[[f"{label} 하차인원" for label in labels]].to_numpy()
+
+        # Row major: each source row becomes `len(labels)` consecutive rows
+        n, k = embark.shape
+        keys = self.data[['사용월', '호선명', '지하철역']].take(np.repeat(np.arange(n), k))
+        segment = keys.set_axis(['date', 'line', 'stn'], axis=1).reset_index(drop=True)
+        return segment.assign(
+            embark=embark.ravel(),
+            disembark=disembark.ravel(),
+            time=pd.Categorical.from_codes(np.tile(np.arange(k), n), categories=labels, ordered=True)
+        )
+
+
+class FloatPopulationSubwayDay:
+    """
+    Daily ridership of every subway station, all months in one store.
+        Each `CARD_SUBWAY_MONTH_YYYYMM.csv` is parsed once into its own parquet partition
+        (`month=YYYYMM`) - `update` only parses month files that are new or changed.
+        Stations and lines are categorical, dates are int32 (YYYYMMDD).
+
+    :param directory: where the store is kept. Defaults to `asset/cache/subway_day`
+    """
+    # Bump when the parsing below changes its output. Every month is parsed again
+    version = '1'
+
+    columns = ['date', 'line', 'stn', 'embark', 'disembark']
+    dtypes = {
+        'date': 'int32',
+        'line': 'category',
+        'stn': 'category',
+        'embark': 'int32',
+        'disembark': 'int32',
+    }
+    filename_pattern = re.compile(r'CARD_SUBWAY_MONTH_(\d{6})\.csv')
+
+    def __init__(self, directory: str = None, update: bool = True, verbose: bool = False):
+        if directory is None:
+            loader = Loader()
+            loader.set_path("./asset/cache/subway_day")
+            directory = loader.path
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+        if update:
+            self.update(verbose)
+
+    @property
+    def manifest_filename(self) -> str:
+        return os.path.join(self.directory, '_manifest.json')  # '_' prefix: not part of the dataset
+
+    def manifest(self) -> dict:
+        # Source file stamp of every ingested month
+        if not os.path.exists(self.manifest_filename):
+            return {'version': self.version, 'months': {}}
+        with open(self.manifest_filename) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != self.version:
+            return {'version': self.version, 'months': {}}
+        return manifest
+
+    @staticmethod
+    def sources() -> dict[int, str]:
+        # Month files in `asset/float_subway`
+        loader = Loader()
+        loader.set_path("./asset/float_subway")
+        found = dict()
+        for filename in sorted(os.listdir(loader.path)):
+            match = FloatPopulationSubwayDay.filename_pattern.fullmatch(filename)
+            if match is not None:
+                found[int(match.group(1))] = f"{loader.path}{filename}"
+        return found
+
+    @property
+    def months(self) -> list[int]:
+        return sorted(int(m) for m in self.manifest()['months'])
+
+    def update(self, verbose: bool = False) -> list[int]:
+        """
+        Ingest month files that are not in the store yet, or changed since.
+        :return: months ingested
+        """
+        manifest = self.manifest()
+        ingested = list()
+        for month, filename in self.sources().items():
+            stat = os.stat(filename)
+            stamp = [stat.st_size, stat.st_mtime_ns]
+            if manifest['months'].get(str(month)) == stamp:
+                continue
+
+            if verbose:
+                print(f"Ingest {filename}")
+            partition = os.path.join(self.directory, f"month={month}")
+            os.makedirs(partition, exist_ok=True)
+            self.parse(filename).to_parquet(os.path.join(partition, 'data.parquet'), index=False)
+
+            manifest['months'][str(month)] = stamp
+            ingested.append(month)
+
+        if ingested:
+            with open(self.manifest_filename, 'w') as f:
+                json.dump(manifest, f)
+        return ingested
+
+    @staticmethod
+    def parse(filename: str) -> pd.DataFrame:
+        # Rows end with an empty column. Header does not have it
+        data = pd.read_csv(
+            filename,
+            encoding='utf-8-sig',
+            header=0,
+            names=FloatPopulationSubwayDay.columns + ['reg_date'],
+            usecols=FloatPopulationSubwayDay.columns,
+            index_col=False,
+            dtype=FloatPopulationSubwayDay.dtypes
+        )
+
+        # Clean process. Clean the categories, not every row
+        stn = pd.DataFrame({'stn': data['stn'].cat.categories})
+        line = pd.DataFrame({'line': data['line'].cat.categories})
+        stn_map = dict(zip(stn['stn'], clean_remove_bracket(stn)['stn']))
+        line_map = dict(zip(line['line'], clean_subway_line_name(line.copy(), 'line')['line']))
+        data['stn'] = data['stn'].map(stn_map).astype('category')
+        data['line'] = data['line'].map(line_map).astype('category')
+        return data
+
+    def query(self,
+              start: int = None,
+              end: int = None,
+              stations: list[str] = None,
+              lines: list[str] = None) -> pd.DataFrame:
+        """
+        Daily ridership in a date range.
+            Only partitions of the months in the range are read.
+        :param start: first date, inclusive (YYYYMMDD)
+        :param end: last date, inclusive (YYYYMMDD)
+        :param stations: station names. All stations if not given
+        :param lines: line names. All lines if not given
+        """
+        filters = list()
+        if start is not None:
+            filters += [('month', '>=', start // 100), ('date', '>=', start)]
+        if end is not None:
+            filters += [('month', '<=', end // 100), ('date', '<=', end)]
+        if stations is not None:
+            filters.append(('stn', 'in', list(stations)))
+        if lines is not None:
+            filters.append(('line', 'in', list(lines)))
+
+        data = pd.read_parquet(
+            self.directory,
+            columns=self.columns,
+            filters=filters or None,
+            partitioning='hive'
+        )
+        return data.astype(self.dtypes).sort_values(['date', 'line', 'stn'], ignore_index=True)
 
 
 if __name__ == "__main__":
@@ -50,11 +239,9 @@ if __name__ == "__main__":
     fpt = FloatPopulationSubwayTime()
     df = fpt.data
 
-    dao = SimpleDatabaseAccess()
-    for i in range(0, 24):
-        dfseg = fpt.get_timely_data(i)
+    with SimpleDatabaseAccess() as dao:
         dao.insert_dataframe(
-            dfseg,
+            fpt.get_hourly_data(),
             'FACTOR_SUBWAY_POPULATION_HOUR',
             subway_tpop_column,
             'append',
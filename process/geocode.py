@@ -0,0 +1,236 @@
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from process.loader import Loader
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+import os
+import re
+import sqlite3
+import threading
+import time
+
+VWORLD_URL = 'http://api.vworld.kr/req/address'
+
+# Responses worth another try. Everything else is answered right away
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def clean_address(addr: str) -> str:
+    """
+    Strip address of brackets substring and whitespaces.
+        서울특별시 중구 세종대로 39 (남대문로4가) -> 서울특별시 중구 세종대로 39
+    The cleaned address is what is sent to vworld, and what the cache is keyed by.
+    """
+    return (re.sub(r'\(.*?\)', '', addr)
+            .strip()
+            .replace('  ', ' '))
+
+
+class GeocodeCache:
+    """
+    On-disk (SQLite) cache of resolved addresses.
+        Address that vworld does not know is stored with NULL coordinates,
+        so it is not asked again either. Failed requests are never stored.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode "
+                "(address TEXT PRIMARY KEY, x REAL, y REAL)"
+            )
+
+    def get_many(self, addresses: list[str]) -> dict[str, dict]:
+        found = dict()
+        with self._lock:
+            # Stay below SQLite's bound parameter limit
+            for i in range(0, len(addresses), 500):
+                chunk = addresses[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT address, x, y FROM geocode WHERE address IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for address, x, y in rows:
+                    found[address] = {'x': np.nan if x is None else x, 'y': np.nan if y is None else y}
+        return found
+
+    def put(self, address: str, coord: dict):
+        x, y = (None if pd.isna(coord[k]) else float(coord[k]) for k in ('x', 'y'))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (address, x, y) VALUES (?, ?, ?)",
+                (address, x, y)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class VWorldGeocoder:
+    """
+    Batch geocoder for vworld address api.
+        One pooled session shared by a bounded thread pool,
+        requests are spaced out to stay under `qps`,
+        transient failures (connection errors, 429, 5xx) are retried with exponential backoff,
+        and every answer is kept in a SQLite cache keyed by the cleaned address.
+
+    :param key: vworld api key. Defaults to `VWORLD` environment variable
+    :param url: api endpoint. Point it to a local server for testing
+    :param cache_path: SQLite file. Defaults to `asset/entity_dart/vworld_geocode.sqlite`.
+        `None` disables the cache
+    :param max_workers: number of concurrent requests
+    :param qps: maximum number of requests started per second
+    :param retries: number of retries after the first attempt
+    :param backoff: first backoff in seconds. Doubled for every retry
+    :param timeout: request timeout in seconds
+    """
+    def __init__(self,
+                 key: str = None,
+                 url: str = VWORLD_URL,
+                 cache_path: str | None = "",
+                 max_workers: int = 8,
+                 qps: float = 10.0,
+                 retries: int = 3,
+                 backoff: float = 0.5,
+                 timeout: float = 10.0,
+                 verbose: bool = False):
+        self.key = key if key is not None else os.getenv('VWORLD')
+        self.url = url
+        self.max_workers = max_workers
+        self.qps = qps
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.verbose = verbose
+
+        # Pool sized to the workers so no connection is thrown away
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        if cache_path == "":
+            loader = Loader()
+            loader.set_path("./asset/entity_dart")
+            cache_path = loader.data_filename_geocode_cache()
+        self.cache = GeocodeCache(cache_path) if cache_path is not None else None
+
+        self._throttle_lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def _throttle(self):
+        # Reserve the next free slot, then wait for it outside the lock
+        if self.qps is None or self.qps <= 0:
+            return
+        with self._throttle_lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1 / self.qps
+        if slot > now:
+            time.sleep(slot - now)
+
+    def query(self, clean_addr: str) -> dict:
+        """
+        Return the coordinate of a cleaned address. Not cached.
+            Coordinate is NaN if vworld cannot find the address (`NOT_FOUND`).
+            Raise FileNotFoundError if vworld does not answer after all the retries,
+            or answers with an error (e.g. invalid key, over the request limit).
+        """
+        if self.verbose:
+            print(f"Query vworld for {clean_addr}")
+
+        params = {
+            "service": "address",
+            "request": "getcoord",
+            "crs": "epsg:4326",
+            "address": clean_addr,
+            "format": "json",
+            "type": "road",
+            "key": self.key
+        }
+        for attempt in range(self.retries + 1):
+            self._throttle()
+            try:
+                resp = self.session.get(self.url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                resp = None
+
+            if resp is not None and resp.status_code not in RETRY_STATUS:
+                break
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt)
+
+        if resp is None or resp.status_code != 200:
+            raise FileNotFoundError(f"Query vworld fail for {clean_addr}")
+        try:
+            response = resp.json()['response']
+            status = response['status']
+        except (KeyError, TypeError, ValueError):
+            raise FileNotFoundError(f"Query vworld fail for {clean_addr}: malformed response")
+
+        if status == 'NOT_FOUND':
+            # Empty coordinate
+            return {'x': np.nan, 'y': np.nan}
+        if status != 'OK':
+            # ERROR comes with HTTP 200 too (invalid key, OVER_REQUEST_LIMIT, ...)
+            error = response.get('error') or dict()
+            raise FileNotFoundError(f"Query vworld fail for {clean_addr}: {error.get('code', status)}")
+        try:
+            point = response['result']['point']
+            return {'x': float(point['x']), 'y': float(point['y'])}
+        except (KeyError, TypeError, ValueError):
+            raise FileNotFoundError(f"Query vworld fail for {clean_addr}: malformed response")
+
+    def geocode(self, addr: str) -> dict:
+        return self.geocode_many([addr]).iloc[0].to_dict()
+
+    def geocode_many(self, addresses: Iterable[str]) -> pd.DataFrame:
+        """
+        Return the coordinates of given full addresses as a DataFrame with `x`, `y` columns,
+            row aligned with `addresses`. Each distinct cleaned address is queried once,
+            and only if it is not in the cache. Failed queries are left as NaN.
+        """
+        cleaned = [clean_address(a) if isinstance(a, str) else None for a in addresses]
+        unique = list(dict.fromkeys(c for c in cleaned if c))
+
+        coords = self.cache.get_many(unique) if self.cache is not None else dict()
+        missing = [c for c in unique if c not in coords]
+        if self.verbose:
+            print(f"{len(unique) - len(missing)} addresses from cache, {len(missing)} to query")
+
+        def _resolve(clean_addr: str):
+            try:
+                coord = self.query(clean_addr)
+            except FileNotFoundError:
+                return clean_addr, None
+            if self.cache is not None:
+                self.cache.put(clean_addr, coord)
+            return clean_addr, coord
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for clean_addr, coord in pool.map(_resolve, missing):
+                if coord is not None:
+                    coords[clean_addr] = coord
+
+        empty = {'x': np.nan, 'y': np.nan}
+        return pd.DataFrame([coords.get(c, empty) if c else empty for c in cleaned],
+                            columns=['x', 'y'],
+                            dtype=float)
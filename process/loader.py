@@ -37,6 +37,9 @@ class Loader:
     def data_filename_collected(self):
         return f"{self.path}corp_info_merged.csv"
 
+    def data_filename_geocode_cache(self):
+        return f"{self.path}vworld_geocode.sqlite"
+
     def data_filename_subway_time(self):
         return f"{self.path}서울시_지하철_호선별_역별_시간대별_승하차_인원_정보.csv"
 
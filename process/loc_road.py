@@ -3,6 +3,7 @@ import pandas as pd
 from shapely.geometry import MultiPoint
 
 from process.loader import Loader
+from process.cache import ProcessedCache, shapefile_sources
 
 
 class RoadMapper:
@@ -11,13 +12,26 @@ class RoadMapper:
         Road (in Seoul) process with LINESTRING(2 coordinatefrom end to end) (standard)
         NPS Entity process. NPS process only gives upper stage of roadname address (comparison)
     """
-    def __init__(self, mod: str = 'v1'):
+    # Bump when the cleaning below changes its output
+    cache_version = '1'
+
+    def __init__(self, mod: str = 'v1', cache: bool = True):
         loader = Loader()
         loader.set_path("./asset/location/road_shape_lite")
-        self.standard = gpd.read_file(
-            loader.data_filename_roadshape_lite_location(),
-            encoding='cp949'
-        )
+        filename = loader.data_filename_roadshape_lite_location()
+
+        self.mod = mod
+        if cache:
+            sources = shapefile_sources(filename)
+            self.standard = ProcessedCache().load(f'road_{mod}', sources, lambda: self._build(filename),
+                                                  self.cache_version)
+        else:
+            self.standard = self._build(filename)
+
+        self.comparison = pd.DataFrame()
+
+    def _build(self, filename: str) -> gpd.GeoDataFrame:
+        self.standard = gpd.read_file(filename, encoding='cp949')
 
         # Replace 'central_meridian_longitude' with the longitude of your central meridian
         self.standard = self.standard.to_crs(epsg=5186)
@@ -33,15 +47,13 @@ class RoadMapper:
         self.standard = self.standard[essential_cols]
 
         # Assign location to each road - version 1 center point
-        self.mod = mod
         if self.mod == 'v1':
             # middle point of the line
             self._v1_assign_coordinate()
         elif self.mod == 'v2':
             # line coordinate
             self._v2_assign_line()
-
-        self.comparison = pd.DataFrame()
+        return self.standard
 
     def mount_comparison(self, nps: pd.DataFrame):
         self.comparison = nps
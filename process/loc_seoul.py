@@ -1,6 +1,7 @@
 import geopandas as gpd
 
 from process.loader import Loader
+from process.cache import ProcessedCache, shapefile_sources
 
 
 class SeoulCityMapper:
@@ -18,21 +19,31 @@ class SeoulCityMapper:
     +units=m: Units of the coordinate system, usually meters.
     +no_defs: Prevents the use of default parameters.
     """
-    def __init__(self):
+    # Bump when the cleaning below changes its output
+    cache_version = '1'
+
+    def __init__(self, cache: bool = True):
         # Load standard process - coordinate process (polygon process)
         loader = Loader()
         loader.set_path("./asset/location/seoul_shape")
-        self.data = gpd.read_file(
-            loader.data_filename_seoulshape_location(),
-            encoding='cp949'
-        )
+        filename = loader.data_filename_seoulshape_location()
+
+        def _build():
+            data = gpd.read_file(filename, encoding='cp949')
+
+            # Coordinate system projection. Bessel/central -> WGS84
+            data = data.to_crs(epsg=5174)  # Default is wgs84, Read as bessel
+            data = data.to_crs(epsg=4326)  # Convert to wgs84
 
-        # Coordinate system projection. Bessel/central -> WGS84
-        self.data = self.data.to_crs(epsg=5174)  # Default is wgs84, Read as bessel
-        self.data = self.data.to_crs(epsg=4326)  # Convert to wgs84
+            # Add central point
+            data['centroid'] = data['geometry'].centroid
+            return data
 
-        # Add central point
-        self.data['centroid'] = self.data['geometry'].centroid
+        if cache:
+            sources = shapefile_sources(filename)
+            self.data = ProcessedCache().load('seoul_shape', sources, _build, self.cache_version)
+        else:
+            self.data = _build()
 
 
 if __name__ == "__main__":
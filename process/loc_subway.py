@@ -1,7 +1,14 @@
 import pandas as pd
+import numpy as np
 
 from process.loader import Loader
-from util import clean_remove_bracket
+from process.cache import ProcessedCache
+from util import BRACKET_PATTERN, SUBWAY_LINE_SPECIFIC, clean_remove_bracket, map_strings
+
+from functools import cached_property
+import difflib
+import heapq
+import unicodedata
 
 
 class SubwayMapper:
@@ -10,15 +17,27 @@ class SubwayMapper:
         subway process with coordinate (standard)
         subway process with float population (comparison)
     """
-    def __init__(self):
+    # Bump when the cleaning below changes its output
+    cache_version = '1'
+
+    def __init__(self, cache: bool = True):
         # Load standard process - coordinate process
         loader = Loader()
         loader.set_path("./asset/location/subway")
-        data = pd.read_csv(loader.data_filename_subway_location())
-        data.columns = ['c1', 'station_name', 'line_name', 'lon', 'lat']
+        filename = loader.data_filename_subway_location()
 
-        self.standard = clean_remove_bracket(data)
+        def _build():
+            data = pd.read_csv(filename)
+            data.columns = ['c1', 'station_name', 'line_name', 'lon', 'lat']
+            return clean_remove_bracket(data)
+
+        if cache:
+            self.standard = ProcessedCache().load('subway_location', filename, _build, self.cache_version)
+        else:
+            self.standard = _build()
         self.comparison = pd.DataFrame()
+        self.unassigned = pd.DataFrame()
+        self._fuzzy_cache = dict()
 
     def mount_comparison(self, tbm: pd.DataFrame,
                          station_name_col: str,
@@ -38,15 +57,124 @@ class SubwayMapper:
         self.comparison = tbm.copy()
         self.comparison.columns = [_name_set_func(c) for c in tbm.columns]
 
-    def create_join_data(self, verboes: bool = False):
+    @staticmethod
+    def normalize_line(value: str) -> str:
+        # 9호선2단계 -> 9호선, 공항철도 1호선 -> 공항철도1호선
+        line_name = value.replace(' ', '')
+        return SUBWAY_LINE_SPECIFIC.get(line_name, line_name)
+
+    @staticmethod
+    def normalize_station(value: str) -> str:
+        # 서울역 -> 서울, 청량리(서울시립대) -> 청량리
+        station_name = BRACKET_PATTERN.sub('', value).replace(' ', '')
+        if len(station_name) > 2 and station_name.endswith('역'):
+            station_name = station_name[:-1]
+        return station_name
+
+    @staticmethod
+    def _jamo(value: str) -> str:
+        # Hangul syllables to their jamo. 강남 -> ㄱㅏㅇㄴㅏㅁ (conjoining jamo)
+        return unicodedata.normalize('NFD', value)
+
+    def _keys(self, data: pd.DataFrame) -> (pd.Series, pd.Series):
+        return (map_strings(data['line_name'], self.normalize_line).astype(object),
+                map_strings(data['station_name'], self.normalize_station).astype(object))
+
+    @cached_property
+    def station_index(self) -> (pd.Index, np.ndarray):
+        """
+        Hash index of the standard stations, keyed by normalized `line|station`. Built once.
+        :return: keys, and the row of `standard` of each key (first one, if listed twice)
+        """
+        line, station = self._keys(self.standard)
+        keys = line + '|' + station
+        first = ~keys.duplicated().to_numpy()
+        return pd.Index(keys[first].to_numpy()), np.flatnonzero(first)
+
+    @cached_property
+    def _line_stations(self) -> dict[str, dict[str, int]]:
+        # Stations of each line, in jamo, for the fuzzy match. `''` holds every station
+        lines = dict()
+        for k, key in enumerate(self.station_index[0]):
+            line, station = key.split('|', 1)
+            jamo = self._jamo(station)
+            lines.setdefault(line, dict()).setdefault(jamo, k)
+            lines.setdefault('', dict()).setdefault(jamo, k)
+        return lines
+
+    def fuzzy_match(self, line: str, station: str, cutoff: float = 0.85, margin: float = 0.05) -> int:
+        """
+        Closest standard station to a (normalized) line and station name that has no exact match.
+            Compared at jamo level, so a single wrong consonant or vowel is a small difference.
+            Searched within the same line, or every station if the line is unknown.
+            Many stations have a near twin on the same line (종로3가 / 종로5가, 옥수 / 약수),
+            so a match is rejected if the runner-up is within `margin` of the best one.
+            Results are cached: every name is fuzzy matched once per mapper.
+        :param cutoff: lowest similarity ratio (0 ~ 1) to accept
+        :param margin: least lead of the best candidate over the runner-up
+        :return: position in `station_index` keys, -1 if nothing is close enough or the match is ambiguous
+        """
+        if (line, station, cutoff, margin) in self._fuzzy_cache:
+            return self._fuzzy_cache[line, station, cutoff, margin]
+
+        candidates = self._line_stations.get(line, self._line_stations[''])
+
+        # Same screening as `difflib.get_close_matches`, but keep the ratios of the top two
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(self._jamo(station))
+        scores = []
+        for jamo in candidates:
+            matcher.set_seq1(jamo)
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff and matcher.ratio() >= cutoff:
+                scores.append((matcher.ratio(), jamo))
+        best = heapq.nlargest(2, scores)
+
+        found = -1
+        if best and (len(best) == 1 or best[0][0] - best[1][0] >= margin):
+            found = candidates[best[0][1]]
+
+        self._fuzzy_cache[line, station, cutoff, margin] = found
+        return found
+
+    def create_join_data(self, verboes: bool = False, fuzzy: bool = False):
+        """
+        Join the comparison with standard coordinates.
+            Exact (normalized) names are hash probed into `station_index`.
+            Names without an exact match fall back to `fuzzy_match` if `fuzzy`.
+            `match` column tells how a row was located ('exact' or 'fuzzy'),
+            and `matched_name` the standard station name it was located with.
+            Rows that still have no location are kept in `unassigned`.
+        """
         merge_key = ['line_name', 'station_name']
         for key in merge_key:
             assert key in self.comparison.columns, f"make sure {key} in comparison process"
             assert key in self.standard.columns, f"make sure {key} in standard process"
 
-        d = pd.merge(self.comparison, self.standard, on=merge_key, how='left')
+        index, rows = self.station_index
+        line, station = self._keys(self.comparison)
+        position = index.get_indexer(line + '|' + station)
+        match = np.where(position >= 0, 'exact', None).astype(object)
+
+        if fuzzy:
+            missing = np.flatnonzero(position < 0)
+            pairs = pd.DataFrame({'line': line.iloc[missing].to_numpy(), 'station': station.iloc[missing].to_numpy()})
+            for (ln, st), at in pairs.groupby(['line', 'station'], sort=False).indices.items():
+                position[missing[at]] = self.fuzzy_match(ln, st)
+            match[missing[position[missing] >= 0]] = 'fuzzy'
+
+        assigned = position >= 0
+        standard = self.standard.iloc[rows[position[assigned]]]
+        d = pd.concat([
+            self.comparison.loc[assigned].reset_index(drop=True),
+            standard.drop(columns=merge_key).reset_index(drop=True)
+        ], axis=1)
+        d['match'] = match[assigned]
+        d['matched_name'] = standard['station_name'].to_numpy()
 
-        subway_loc_assigned = d.loc[d['lat'].notnull()]
-        _subway_loc_unassigned = d.loc[d['lat'].isnull()]  # TODO: Find a way to figure out missing location
+        subway_loc_assigned = d
+        self.unassigned = self.comparison.loc[~assigned]  # Neither exact nor close name
+        if verboes:
+            print(f"{assigned.sum()} rows located ({(match == 'fuzzy').sum()} by fuzzy match), "
+                  f"{(~assigned).sum()} rows without location")
 
         return subway_loc_assigned
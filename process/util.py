@@ -1,39 +1,65 @@
 import pandas as pd
+import numpy as np
 
+from typing import Callable
 import re
 
 
+# delete all the substrings that's inside a bracket
+BRACKET_PATTERN = re.compile(r'\([^()]*\)')
+
+# NOTE: if more exception occurs, record here.
+SUBWAY_LINE_SPECIFIC = {'9호선2~3단계': '9호선', '9호선2단계': '9호선'}
+
+
+def map_strings(values: pd.Series, func: Callable[[str], str]) -> pd.Series:
+    """
+    Apply `func` to the string values of a column. Other values are kept as they are.
+        `func` runs once per distinct string, not once per row - station names repeat heavily.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype) or \
+            (pd.api.types.is_string_dtype(values.dtype) and values.dtype != object):
+        # Every value is a string (or missing). Categorical maps its categories only
+        uniques = values.dropna().unique()
+        if len(uniques) == 0:
+            return values.copy()
+        return values.map({u: func(u) if isinstance(u, str) else u for u in uniques}, na_action='ignore')
+
+    codes, uniques = pd.factorize(values)
+    is_string = np.fromiter((isinstance(u, str) for u in uniques), dtype=bool, count=len(uniques))
+    if not is_string.any():
+        # Nothing to clean. Same type inference as mapping the column would do
+        return values.infer_objects()
+    mapped = np.array([func(u) if s else None for u, s in zip(uniques, is_string)] + [None], dtype=object)
+
+    # Non strings and missing values (code -1) are taken from `values` itself
+    take = np.append(is_string, False)[codes]
+    result = np.where(take, mapped[codes], values.to_numpy(dtype=object))
+    return pd.Series(result, index=values.index, name=values.name)
+
+
 def clean_remove_bracket(df: pd.DataFrame) -> pd.DataFrame:
     """
     Station name sells another name in their bracket for money.
         For example 청량리(서울시립대). Turn it into 청량리
     With function that remove whatever value that was inside the bracket.
         clean up the database
+    Only text columns are touched, and each distinct value is cleaned once.
     """
-    def _remove_bracket_string(value: any):
-        if not isinstance(value, str):
-            return value
-
-        # delete all the substrings that's inside a bracket
-        pattern = r'\([^()]*\)'
-        return re.sub(pattern, '', value)
+    def _remove_bracket_string(value: str):
+        return BRACKET_PATTERN.sub('', value)
 
-    return df.map(_remove_bracket_string)
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object or isinstance(df[col].dtype, (pd.StringDtype, pd.CategoricalDtype)):
+            df[col] = map_strings(df[col], _remove_bracket_string)
+    return df
 
 
 def clean_subway_line_name(df: pd.DataFrame, subway_line_colname: str) -> pd.DataFrame:
-    # NOTE: if more exception occurs, record here.
-    specific = {'9호선2~3단계': '9호선', '9호선2단계': '9호선'}
-
-    def _target_delete(value: any):
-        if not isinstance(value, str):
-            return value
-
+    def _target_delete(value: str):
         line_name = value.replace(' ', '')  # Remove whitespace
-        if line_name in specific.keys():
-            return specific[line_name]
-        else:
-            return line_name
+        return SUBWAY_LINE_SPECIFIC.get(line_name, line_name)
 
-    df[subway_line_colname] = df[subway_line_colname].map(_target_delete)
+    df[subway_line_colname] = map_strings(df[subway_line_colname], _target_delete)
     return df